@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""
+Per-sample latency and main process CPU use of ServiceDelegate.get_data,
+using the example services from run_client_test.py.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.delegate_wait_bench [samples] [sample_rate]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from src.sensor_services.sensing_service_manager import SensingServiceManager
+
+from src.sensor_services.impl.example_service import ExampleService
+from src.sensor_services.impl.example_service_long import ExampleServiceLong
+
+
+async def timed_get_data(delegate, data_timeout):
+    start = time.perf_counter()
+    data = await delegate.get_data(data_timeout=data_timeout)
+    return time.perf_counter() - start, data
+
+
+async def run_benchmark(samples, sample_rate):
+    service_manager = SensingServiceManager(
+        [ExampleService, ExampleServiceLong])
+
+    await service_manager.start()
+
+    data_timeout = 1 / sample_rate
+    latencies = {service_id: [] for service_id in service_manager.registered_services}
+    timeouts = {service_id: 0 for service_id in service_manager.registered_services}
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    for _ in range(samples):
+        active = [service_manager.registered_services[service_id]
+                  for service_id in service_manager.get_active_services()]
+
+        results = await asyncio.gather(
+            *[timed_get_data(delegate, data_timeout) for delegate in active])
+
+        for delegate, (latency, data) in zip(active, results):
+            if data is False:
+                timeouts[delegate.service_id] += 1
+            else:
+                latencies[delegate.service_id].append(latency)
+
+    cpu_used = time.process_time() - cpu_start
+    wall_time = time.perf_counter() - wall_start
+
+    print("samples: {}, sample rate: {} Hz, wall time: {:.2f} s".format(
+        samples, sample_rate, wall_time))
+    print("main process cpu: {:.3f} s ({:.3f} ms/sample, {:.1f}% of one core)".format(
+        cpu_used, 1000 * cpu_used / samples, 100 * cpu_used / wall_time))
+
+    for service_id, service_latencies in latencies.items():
+        if not service_latencies:
+            print("{}: no successful samples, {} timeouts".format(
+                service_id, timeouts[service_id]))
+            continue
+
+        service_latencies.sort()
+        print("{}: p50 {:.2f} ms, p99 {:.2f} ms, mean {:.2f} ms, {} timeouts".format(
+            service_id,
+            1000 * service_latencies[len(service_latencies) // 2],
+            1000 * service_latencies[int(len(service_latencies) * 0.99)],
+            1000 * statistics.mean(service_latencies),
+            timeouts[service_id]))
+
+    for service_id in service_manager.get_active_services():
+        service_manager.terminate_service(service_id)
+
+
+if __name__ == "__main__":
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    sample_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    asyncio.run(run_benchmark(samples, sample_rate))
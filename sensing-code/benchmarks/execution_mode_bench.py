@@ -0,0 +1,138 @@
+#!/usr/bin/python
+"""
+Startup time, memory and get_data latency of services run as processes
+(isolated) against threads in the client process.
+
+Each mode runs in a fresh interpreter with a number of trivial services,
+whose read_data returns straight away, so what's measured is the
+execution backend rather than the sensor.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.execution_mode_bench [samples] [services]
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from src.sensor_services.sensing_service import SensingService
+from src.sensor_services.schema import Field, Schema
+from src.sensor_services.sensing_service_manager import SensingServiceManager
+
+
+class BenchService(SensingService):
+
+    __id__ = "bench_service"
+
+    schema = Schema([
+        Field("value", "f8", unit="s")
+    ])
+
+    def configure(self, config):
+        return
+
+    def startup(self):
+        return
+
+    def read_data(self):
+        return {"value": time.time()}
+
+    def teardown(self):
+        return
+
+
+def memory_kb(pid):
+    """(rss, pss) of a process in kB, pss counts shared pages fractionally."""
+    rss = pss = 0
+
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1])
+
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    pss = int(line.split()[1])
+    except OSError:
+        pss = rss
+
+    return rss, pss
+
+
+async def run_mode(isolated, samples, n_services):
+    services = [type("BenchService{}".format(i), (BenchService,), {"__id__": "bench_service_{}".format(i)})
+                for i in range(n_services)]
+
+    service_manager = SensingServiceManager(services)
+    for service in services:
+        service_manager.configure_service(
+            service.__id__, {"isolated": isolated})
+
+    start = time.perf_counter()
+    await asyncio.gather(*[service_manager.start_service(service.__id__)
+                           for service in services])
+    startup = time.perf_counter() - start
+
+    delegates = list(service_manager.registered_services.values())
+
+    pids = {os.getpid()}
+    for delegate in delegates:
+        if delegate.active_handle is not None and hasattr(delegate.active_handle.process, "pid"):
+            pids.add(delegate.active_handle.process.pid)
+
+    memory = [memory_kb(pid) for pid in pids]
+
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(samples):
+        for delegate in delegates:
+            sample_start = time.perf_counter()
+            await delegate.get_data(data_timeout=1)
+            latencies.append(time.perf_counter() - sample_start)
+    cpu_used = time.process_time() - cpu_start
+
+    for delegate in delegates:
+        delegate.stop()
+
+    latencies.sort()
+
+    return {
+        "mode": "process" if isolated else "thread",
+        "services": n_services,
+        "startup_ms": 1000 * startup,
+        "rss_mb": sum(rss for rss, _ in memory) / 1024,
+        "pss_mb": sum(pss for _, pss in memory) / 1024,
+        "p50_ms": 1000 * latencies[len(latencies) // 2],
+        "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+        "main_cpu_ms_per_sample": 1000 * cpu_used / len(latencies),
+    }
+
+
+if __name__ == "__main__":
+    if "--mode" in sys.argv:
+        # one mode, in this interpreter
+        args = sys.argv[sys.argv.index("--mode") + 1:]
+        result = asyncio.run(run_mode(
+            args[0] == "process", int(args[1]), int(args[2])))
+        print(json.dumps(result))
+        sys.exit(0)
+
+    samples = sys.argv[1] if len(sys.argv) > 1 else "500"
+    n_services = sys.argv[2] if len(sys.argv) > 2 else "4"
+
+    for mode in ("process", "thread"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.execution_mode_bench",
+             "--mode", mode, samples, n_services],
+            capture_output=True, text=True, check=True).stdout
+
+        result = json.loads(output.strip().splitlines()[-1])
+        print("{mode}: {services} services up in {startup_ms:.1f} ms, "
+              "rss {rss_mb:.1f} MB (pss {pss_mb:.1f} MB), "
+              "get_data p50 {p50_ms:.3f} ms p99 {p99_ms:.3f} ms, "
+              "main cpu {main_cpu_ms_per_sample:.3f} ms/sample".format(**result))
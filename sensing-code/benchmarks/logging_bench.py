@@ -0,0 +1,70 @@
+#!/usr/bin/python
+"""
+What logging costs the acquisition path: get_data round trips per second
+with trivial in-process services polled back to back (so the per sample
+debug logs of the delegate and the service dominate), the client's cpu
+per request and how many bytes of log that writes.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.logging_bench [seconds] [services]
+"""
+import asyncio
+import glob
+import os
+import sys
+import time
+
+from src.sensor_services.sensing_service_manager import SensingServiceManager
+from src.utils.logging_utils import get_cur_logger_dir
+
+from benchmarks.execution_mode_bench import BenchService
+
+
+def log_bytes():
+    return sum(os.path.getsize(f) for f in glob.glob(get_cur_logger_dir() + "/*.log"))
+
+
+async def run_benchmark(seconds, n_services):
+    services = [type("LogBenchService{}".format(i), (BenchService,), {"__id__": "log_bench_service_{}".format(i)})
+                for i in range(n_services)]
+
+    service_manager = SensingServiceManager(services)
+    for service in services:
+        # no rate limit, the point is to go as fast as the path allows
+        service_manager.configure_service(
+            service.__id__, {"isolated": False, "max_sample_rate": 1e6})
+
+    await asyncio.gather(*[service_manager.start_service(service.__id__)
+                           for service in services])
+
+    delegates = list(service_manager.registered_services.values())
+
+    bytes_start = log_bytes()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+
+    requests = 0
+    while time.perf_counter() - start < seconds:
+        await asyncio.gather(*[delegate.get_data(data_timeout=1) for delegate in delegates])
+        requests += len(delegates)
+
+    wall = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    await service_manager.stop_services()
+
+    # let queued log records reach the files
+    time.sleep(0.5)
+
+    return requests / wall, 1e6 * cpu / requests, (log_bytes() - bytes_start) / requests
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    n_services = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    rate, cpu_us, bytes_per_request = asyncio.run(run_benchmark(seconds, n_services))
+
+    print("{} services: {:.0f} get_data/s, {:.0f} us client cpu per request, {:.0f} log bytes per request".format(
+        n_services, rate, cpu_us, bytes_per_request))
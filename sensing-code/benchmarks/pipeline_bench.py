@@ -0,0 +1,364 @@
+#!/usr/bin/python
+"""
+End to end throughput and latency of the acquisition pipeline: a
+SensingServiceManager with a number of synthetic services, feeding a
+DataLogger writing to a temporary directory, so it runs headless without
+any sensors.
+
+For every combination of services, rate and payload width it reports:
+
+- achieved against requested rate, of rows and of each service's samples
+- p50/p99 request latency (poll mode) and sample age at merge
+- time per stage: ipc (get_data, or collecting the stream), merge and
+  logging (handing a row to the writer, and the writer's flushes)
+- cpu and rss of the client process, and cpu of each worker and the writer
+- rows and samples lost
+
+Each combination runs in a fresh interpreter. Results are printed and,
+with --json, written as JSON to compare between releases.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.pipeline_bench --services 1,4 --rates 5,50 --widths 4,64 --json results.json
+"""
+import argparse
+import asyncio
+from collections import deque
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from src.sensing_client import DataLogger
+from src.sensor_services.impl.synthetic_service import SyntheticService
+from src.sensor_services.merge import age_key
+from src.sensor_services.sensing_service_manager import SensingServiceManager
+from src.utils.process_stats import cpu_seconds, rss_bytes, worker_ids
+
+
+def percentiles(values):
+    """p50, p99 and max of values, in ms."""
+    if not values:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+
+    values = sorted(values)
+    return {
+        "p50_ms": 1000 * values[len(values) // 2],
+        "p99_ms": 1000 * values[min(int(len(values) * 0.99), len(values) - 1)],
+        "max_ms": 1000 * values[-1],
+    }
+
+
+def rss_mb(pid):
+    rss = rss_bytes(pid)
+    return None if rss is None else rss / (1024 * 1024)
+
+
+class Recorder:
+    """Collects timings while active, i.e. after the warmup."""
+
+    def __init__(self):
+        self.active = False
+        self.times = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        if self.active:
+            self.times.setdefault(name, []).append(seconds)
+
+    def count(self, name, n=1):
+        if self.active:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def timed(self, name, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return wrapper
+
+    def timed_request(self, name, fn):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = await fn(*args, **kwargs)
+            self.add(name, time.perf_counter() - start)
+            self.count(name + "_errors", 0 if isinstance(result, dict) else 1)
+            return result
+        return wrapper
+
+
+class SampleCounter(deque):
+    """A delegate's stream buffer which notes the sequence number of every sample."""
+
+    def __init__(self, recorder, seq_key, maxlen):
+        super().__init__(maxlen=maxlen)
+        self.recorder = recorder
+        self.seq_key = seq_key
+        self.seqs = set()
+
+    def append(self, record):
+        self._note(record)
+        super().append(record)
+
+    def extend(self, records):
+        records = list(records)
+        for record in records:
+            self._note(record)
+        super().extend(records)
+
+    def _note(self, record):
+        if self.recorder.active:
+            self.seqs.add(record[1][self.seq_key])
+
+
+def workers(service_manager):
+    """(service id, pid, tid) of each service's worker, tid None for a process."""
+    found = []
+    for service_id, delegate in service_manager.registered_services.items():
+        handle = delegate.active_handle
+        if handle is None:
+            continue
+        found.append((service_id, *worker_ids(handle)))
+    return found
+
+
+async def run(config):
+    recorder = Recorder()
+
+    service_rate = config["service_rate"] or config["rate"]
+    services = [
+        SyntheticService.define(
+            "synthetic_{}".format(i), width=config["width"],
+            rate=service_rate, sample_rate=service_rate,
+            latency={"distribution": config["latency"], "mean": config["latency_ms"] / 1000},
+            failure_rate=config["failure_rate"], isolated=config["isolated"])
+        for i in range(config["services"])]
+
+    service_manager = SensingServiceManager(services)
+
+    # per stage timings, wrapped around the instances' own methods
+    service_manager.get_merged_data = recorder.timed(
+        "merge", service_manager.get_merged_data)
+
+    counters = {}
+    for service in services:
+        delegate = service_manager.registered_services[service.__id__]
+        delegate.get_data = recorder.timed_request("request", delegate.get_data)
+        delegate.collect_stream = recorder.timed("collect_stream", delegate.collect_stream)
+
+        counters[service.__id__] = delegate.stream_buffer = SampleCounter(
+            recorder, service.schema.keys[0], delegate.stream_buffer.maxlen)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_logger = DataLogger(
+            data_dir, service_manager.get_output_schema(), backend=config["backend"])
+
+        await service_manager.start()
+
+        started = time.time()
+        measure_from = started + config["warmup"]
+        measure_to = measure_from + config["duration"]
+
+        rows = 0
+        rows_logged = 0
+        ages = []
+        cpu_start = {}
+
+        async for row in service_manager.monitor_services(
+                sample_rate=config["rate"], streaming=config["streaming"]):
+
+            now = time.time()
+
+            if not recorder.active and now >= measure_from:
+                recorder.active = True
+                wall_start = time.perf_counter()
+                cpu_start["client"] = cpu_seconds(os.getpid())
+                cpu_start["writer"] = cpu_seconds(os.getpid(), data_logger.writer.native_id)
+                for service_id, pid, tid in workers(service_manager):
+                    cpu_start[service_id] = cpu_seconds(pid, tid)
+
+            if now >= measure_to:
+                break
+
+            start = time.perf_counter()
+            data_logger.print(row)
+            recorder.add("log", time.perf_counter() - start)
+            rows_logged += 1
+
+            if recorder.active:
+                rows += 1
+                for service in services:
+                    age = row.get(age_key(service.__id__))
+                    if age is not None:
+                        ages.append(age)
+                    else:
+                        recorder.count("rows_missing_service")
+
+        wall = time.perf_counter() - wall_start
+
+        processes = {"client": {
+            "cpu_pct": 100 * (cpu_seconds(os.getpid()) - cpu_start["client"]) / wall,
+            "rss_mb": rss_mb(os.getpid()),
+        }, "writer": {
+            "cpu_pct": 100 * (cpu_seconds(os.getpid(), data_logger.writer.native_id) - cpu_start["writer"]) / wall,
+            "rss_mb": None,
+        }}
+        for service_id, pid, tid in workers(service_manager):
+            cpu = cpu_seconds(pid, tid)
+            processes[service_id] = {
+                "cpu_pct": None if cpu is None or cpu_start.get(service_id) is None
+                else 100 * (cpu - cpu_start[service_id]) / wall,
+                # a thread shares the client's memory
+                "rss_mb": rss_mb(pid) if tid is None else None,
+            }
+
+        scheduler_stats = service_manager.scheduler.stats()
+
+        for service_id in service_manager.get_active_services():
+            service_manager.terminate_service(service_id)
+
+        # everything is written out by the time it's closed
+        writer = data_logger.writer
+        data_logger.close()
+        writer_metrics = writer.metrics()
+
+    samples = {}
+    for service_id, counter in counters.items():
+        received = len(counter.seqs)
+        produced = max(counter.seqs) - min(counter.seqs) + 1 if counter.seqs else 0
+        samples[service_id] = {
+            "requested_hz": service_rate,
+            "achieved_hz": received / wall,
+            "received": received,
+            # only all of them are meant to arrive when streaming, polling
+            # takes the latest
+            "lost": produced - received,
+        }
+
+    return {
+        "config": config,
+        "rows": {
+            "requested_hz": config["rate"],
+            "achieved_hz": rows / wall,
+            "yielded": rows,
+            "ticks_skipped": scheduler_stats["skipped_ticks"],
+            "p99_jitter_ms": scheduler_stats["p99_jitter_ms"],
+            # rows handed to the logger, warmup included, which weren't written
+            "lost": rows_logged - writer_metrics["rows_written"],
+            "dropped_by_writer": writer_metrics["rows_dropped"],
+            # rows without some service's sample
+            "missing_service": recorder.counts.get("rows_missing_service", 0),
+        },
+        "samples": samples,
+        "request_latency": dict(percentiles(recorder.times.get("request", [])),
+                                errors=recorder.counts.get("request_errors", 0)),
+        "sample_age": percentiles(ages),
+        "stages": {
+            "ipc": percentiles(recorder.times.get("request" if not config["streaming"] else "collect_stream", [])),
+            "merge": percentiles(recorder.times.get("merge", [])),
+            "log": percentiles(recorder.times.get("log", [])),
+            "max_flush_ms": writer_metrics["max_flush_latency_ms"],
+        },
+        "processes": processes,
+    }
+
+
+def machine():
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = None
+
+    return {
+        "revision": revision or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.time(),
+    }
+
+
+def summary(result):
+    config = result["config"]
+    return ("{services} x {width} wide at {rate} Hz{streaming}: rows {achieved:.1f}/{rate} Hz, "
+            "request p50 {p50} p99 {p99} ms ({errors} errors), merge p99 {merge} ms, log p99 {log} ms, "
+            "client cpu {cpu:.0f}% rss {rss:.0f} MB, rows lost {lost}, samples lost {samples_lost}").format(
+        services=config["services"], width=config["width"], rate=config["rate"],
+        streaming=" streaming" if config["streaming"] else "",
+        achieved=result["rows"]["achieved_hz"],
+        p50=_ms(result["request_latency"]["p50_ms"]), p99=_ms(result["request_latency"]["p99_ms"]),
+        errors=result["request_latency"]["errors"],
+        merge=_ms(result["stages"]["merge"]["p99_ms"]), log=_ms(result["stages"]["log"]["p99_ms"]),
+        cpu=result["processes"]["client"]["cpu_pct"], rss=result["processes"]["client"]["rss_mb"],
+        lost=result["rows"]["lost"] + result["rows"]["ticks_skipped"],
+        samples_lost=sum(s["lost"] for s in result["samples"].values()))
+
+
+def _ms(value):
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+def _list(kind):
+    return lambda value: [kind(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    if "--run" in sys.argv:
+        # child: one combination, in this interpreter
+        config = json.loads(sys.argv[sys.argv.index("--run") + 1])
+        print(json.dumps(asyncio.run(run(config))))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the acquisition pipeline with synthetic services")
+    parser.add_argument("--services", type=_list(int), default=[1, 4],
+                        help="comma separated numbers of services")
+    parser.add_argument("--rates", type=_list(float), default=[5, 50],
+                        help="comma separated row rates (Hz)")
+    parser.add_argument("--widths", type=_list(int), default=[4, 64],
+                        help="comma separated payload widths (values per sample)")
+    parser.add_argument("--service-rate", type=float, default=None,
+                        help="rate each service samples at, default the row rate")
+    parser.add_argument("--latency", default="lognormal",
+                        choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--latency-ms", type=float, default=1)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--isolated", action="store_true",
+                        help="run services as processes rather than threads")
+    parser.add_argument("--backend", default="chunked", choices=["chunked", "csv"])
+    parser.add_argument("--duration", type=float, default=10, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for n_services in args.services:
+        for rate in args.rates:
+            for width in args.widths:
+                config = {
+                    "services": n_services, "rate": rate, "width": width,
+                    "service_rate": args.service_rate, "latency": args.latency,
+                    "latency_ms": args.latency_ms, "failure_rate": args.failure_rate,
+                    "streaming": args.streaming, "isolated": args.isolated,
+                    "backend": args.backend, "duration": args.duration, "warmup": args.warmup,
+                }
+
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.pipeline_bench", "--run", json.dumps(config)],
+                    capture_output=True, text=True, check=True).stdout
+
+                result = json.loads(output.strip().splitlines()[-1])
+                results.append(result)
+                print(summary(result))
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"machine": machine(), "results": results}, f, indent=2)
+        print("Wrote {} results to {}".format(len(results), args.json))
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""
+Cost per packet of parsing POPS UDP datagrams: PopsParser against the
+previous read_data parsing followed by the schema coerce every sample
+went through.
+
+The packets are synthetic POPS-220 lines with the layout and value
+formats of the instrument's output, with varying values.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.pops_parser_bench [packets]
+"""
+import random
+import sys
+import time
+
+from src.sensor_services.impl.dust_service import DustService, POPS_COLUMNS, PopsParser
+
+
+def make_packet(i, nbins=16):
+    values = [
+        "POPS", "POPS-220", "F20220124x001.csv", "2022-01-24T14:03:{:02d}".format(i % 60),
+        "{:.2f}".format(50000 + i / 10), "0", "0", str(random.randint(0, 500)), str(random.randint(0, 500)),
+        "{:.3f}".format(random.random() * 100), "1500", "1560", "{:.2f}".format(random.random() * 5),
+        "{:.2f}".format(random.random() * 10), "{:.1f}".format(990 + random.random()),
+        "{:.2f}".format(25 + random.random()), "{:.2f}".format(300 + random.random()),
+        "{:.2f}".format(random.random()), "{:.2f}".format(10 + random.random()),
+        "{:.3f}".format(3 + random.random() / 10), "100", "{:.2f}".format(30 + random.random()),
+        "100", "1", "{:.2f}".format(25 + random.random()), "{:.2f}".format(12 + random.random()),
+        "{:.1f}".format(50 + random.random()), "3.00", "100", "3.00", str(nbins), "1.75", "4.81",
+        "0", "5", "255", "1",
+    ] + [str(random.randint(0, 1000)) for _ in range(nbins)]
+
+    return (",".join(values) + "\r\n").encode("utf-8")
+
+
+def legacy_parse(data):
+    """read_data's parsing before PopsParser, followed by the coerce in _sample."""
+    s_data = data.decode('utf-8')
+
+    cols = list(POPS_COLUMNS)
+
+    first_line = s_data.split('\r\n')[0]
+    split_first_line = first_line.split(',')
+
+    if split_first_line[0] != 'POPS':
+        raise Exception("Failed to get magic value 'POPS'")
+
+    nbins = int(split_first_line[cols.index("nbins")])
+
+    cols += ["b{}".format(i) for i in range(nbins)]
+
+    return DustService.schema.coerce(dict(zip(cols, split_first_line)))
+
+
+def time_per_packet(parse, packets):
+    start = time.perf_counter()
+    for packet in packets:
+        parse(packet)
+    return (time.perf_counter() - start) / len(packets)
+
+
+if __name__ == "__main__":
+    n_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    random.seed(0)
+    packets = [make_packet(i) for i in range(n_packets)]
+
+    parser = PopsParser(DustService.schema)
+
+    # same samples either way
+    for packet in packets[:100]:
+        assert parser.parse(packet) == legacy_parse(packet)
+
+    legacy = time_per_packet(legacy_parse, packets)
+    parsed = time_per_packet(parser.parse, packets)
+
+    start = time.perf_counter()
+    parser.parse_many(packets)
+    batched = (time.perf_counter() - start) / n_packets
+
+    print("{} packets of {} bytes".format(n_packets, len(packets[0])))
+    print("legacy parse + coerce: {:.2f} us/packet".format(1e6 * legacy))
+    print("PopsParser.parse:      {:.2f} us/packet ({:.1f}x)".format(
+        1e6 * parsed, legacy / parsed))
+    print("PopsParser.parse_many: {:.2f} us/packet ({:.1f}x)".format(
+        1e6 * batched, legacy / batched))
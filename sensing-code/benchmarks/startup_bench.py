@@ -0,0 +1,107 @@
+#!/usr/bin/python
+"""
+Startup cost of the headless acquisition path: the import time of
+run_client (from python -X importtime, against IMPORT_BUDGET_MS) and the
+time from launching the interpreter to the first sample being handed to
+the data logger, using the example services.
+
+Run from the sensing-code directory:
+
+    python -m benchmarks.startup_bench [runs]
+
+Exits non-zero if the import time is over budget.
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# import time budget for run_client, on a desktop. A Pi is roughly 10x slower.
+IMPORT_BUDGET_MS = 150
+
+# heaviest modules to list
+TOP_MODULES = 10
+
+
+def import_times(module):
+    """(total ms, [(cumulative ms, module)]) from python -X importtime."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        capture_output=True, text=True, check=True).stderr
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative) / 1000, name.strip()))
+
+    total = next(ms for ms, name in modules if name == module)
+    return total, modules
+
+
+async def first_sample(launched):
+    # imported here, the point is to time it
+    from src.sensing_client import DataLogger, SAMPLE_RATE
+    from src.sensor_services.sensing_service_manager import SensingServiceManager
+    from src.sensor_services.impl.example_service import ExampleService
+
+    service_manager = SensingServiceManager([ExampleService])
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        data_logger = DataLogger(data_dir, service_manager.get_output_schema())
+
+        await service_manager.start()
+
+        async for data in service_manager.monitor_services(sample_rate=SAMPLE_RATE):
+            data_logger.print(data)
+            break
+
+        elapsed = time.time() - launched
+
+        data_logger.close()
+        for service_id in service_manager.get_active_services():
+            service_manager.terminate_service(service_id)
+
+    return elapsed
+
+
+if __name__ == "__main__":
+    if "--first-sample" in sys.argv:
+        # child: launched at the time given by the parent
+        launched = float(sys.argv[sys.argv.index("--first-sample") + 1])
+        print(asyncio.run(first_sample(launched)))
+        sys.exit(0)
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    totals = []
+    for _ in range(runs):
+        total, modules = import_times("run_client")
+        totals.append(total)
+
+    import_ms = statistics.median(totals)
+
+    print("run_client import: {:.1f} ms median of {} (budget {} ms)".format(
+        import_ms, runs, IMPORT_BUDGET_MS))
+    for cumulative, name in sorted(modules, reverse=True)[1:TOP_MODULES + 1]:
+        print("  {:8.1f} ms  {}".format(cumulative, name))
+
+    first_samples = []
+    for _ in range(runs):
+        launched = time.time()
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup_bench",
+             "--first-sample", str(launched)],
+            capture_output=True, text=True, check=True, env=dict(os.environ)).stdout
+        first_samples.append(float(output.strip().splitlines()[-1]))
+
+    print("time to first sample: {:.1f} ms median of {} (min {:.1f} ms, max {:.1f} ms)".format(
+        1000 * statistics.median(first_samples), runs,
+        1000 * min(first_samples), 1000 * max(first_samples)))
+
+    sys.exit(0 if import_ms <= IMPORT_BUDGET_MS else 1)
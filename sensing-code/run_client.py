@@ -1,6 +1,5 @@
 #!/usr/bin/python
-import sys
-from src.sensing_client import SensingClient
+from src.sensing_client import SensingClient, parse_args
 
 from src.sensor_services.sensing_service_manager import SensingServiceManager
 
@@ -11,9 +10,7 @@ from src.sensor_services.impl.dust_service import DustService
 from src.sensor_services.impl.co2_service import CO2Service
 
 if __name__ == "__main__":
-    reboot_mode = False
-    if "--on-reboot" in sys.argv:
-        reboot_mode = True
+    args = parse_args()
 
     service_manager = SensingServiceManager(
         (GPSService,
@@ -28,4 +25,6 @@ if __name__ == "__main__":
         "serial_timeout": 1
     })
 
-    SensingClient(service_manager=service_manager)
+    SensingClient(service_manager=service_manager,
+                  streaming=args.streaming, storage_backend=args.storage_backend,
+                  merge_mode=args.merge_mode, metrics_port=args.metrics_port)
@@ -1,6 +1,5 @@
 #!/usr/bin/python
-import sys
-from src.sensing_client import SensingClient
+from src.sensing_client import SensingClient, parse_args
 
 from src.sensor_services.sensing_service_manager import SensingServiceManager
 
@@ -9,13 +8,13 @@ from src.sensor_services.impl.example_service_long import ExampleServiceLong
 
 
 if __name__ == "__main__":
-    reboot_mode = False
-    if "--on-reboot" in sys.argv:
-        reboot_mode = True
+    args = parse_args()
 
     example_services = [ExampleService, ExampleServiceLong]
 
     service_manager = SensingServiceManager(
         example_services
     )
-    SensingClient(service_manager=service_manager)
+    SensingClient(service_manager=service_manager,
+                  streaming=args.streaming, storage_backend=args.storage_backend,
+                  merge_mode=args.merge_mode, metrics_port=args.metrics_port)
@@ -1,16 +1,12 @@
-import qwiic_bme280
 import time
 import sys
 import plotext as plt
-import numpy as np
-import pandas as pd
 
 from rich.console import Console
 from rich.markdown import Markdown
 from rich import print
 from rich.prompt import Prompt
 from rich.prompt import Confirm
-import inquirer
 from rich.live import Live
 from rich.table import Table
 import signal
@@ -22,8 +18,6 @@ import math
 from record_settings import get_record_settings
 
 from rich.progress import Progress
-from ublox_gps import UbloxGps
-import serial
 
 from rich.progress import track
 
@@ -31,7 +25,12 @@ from rich.progress import track
 ENABLED_FLAGS = ["GPS_UBLOX", "PHT_Sense"]
 
 
+# hardware drivers, pandas, numpy and inquirer are imported where they're
+# used, so starting up (and resuming a recording on boot) stays quick
+
+
 def resume_record():
+    import qwiic_bme280
 
     mySensor = qwiic_bme280.QwiicBme280()
     if not mySensor.connected:
@@ -143,6 +142,8 @@ def toggle_start_on_boot():
 
 
 def is_time_delta(x):
+    import pandas as pd
+
     try:
         pd.Timedelta(x)
         return True
@@ -175,6 +176,8 @@ def set_record_settings(record_till):
 
 
 def record_data_choices():
+    import pandas as pd
+
     global ctrl_c_flag
     plt.clt()
 
@@ -194,6 +197,8 @@ def record_data_choices():
 
 
 def choose_action():
+    import inquirer
+
     global ctrl_c_flag
 
     plt.clt()
@@ -235,6 +240,8 @@ def choose_action():
 
 
 def view_live_data():
+    import qwiic_bme280
+
     global ctrl_c_flag
     plt.clear_terminal()
 
@@ -280,6 +287,9 @@ def view_live_data():
 
 
 def view_live_data_graph():
+    import numpy as np
+    import qwiic_bme280
+
     global ctrl_c_flag
     plt.clear_terminal()
 
@@ -0,0 +1,253 @@
+"""
+Metrics of a running SensingClient in the Prometheus text format, served
+over HTTP from a thread of its own, so a unit can be checked on (or
+scraped) without logging in to it:
+
+    curl http://<unit>:<port>/metrics
+
+Per service: achieved sample rate, request latency histogram, errors by
+kind (timeouts among them), restarts, health, and the cpu and memory of
+its worker. Also the data logger's queue, rows and bytes written, the
+log handlers' queues and the scheduler's overruns.
+"""
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import threading
+import time
+
+from .sensor_services.service_stats import LATENCY_BUCKETS
+from .utils.logging_utils import BackgroundLogHandler
+from .utils.process_stats import cpu_seconds, rss_bytes, worker_ids
+
+# how long a scrape waits for the event loop to take its snapshot
+COLLECT_TIMEOUT = 5
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def collect(service_manager, data_logger=None):
+    """
+    Snapshot of everything served. Taken on the event loop, so nothing
+    changes under it, and cheap: the /proc reads and formatting are left
+    to render().
+    """
+    now = time.time()
+
+    services = {}
+    for service_id, delegate in service_manager.registered_services.items():
+        stats = delegate.stats
+        services[service_id] = {
+            "up": delegate.is_running,
+            "health": stats.health(now),
+            "sample_rate": stats.sample_rate(now),
+            "samples": stats.successes,
+            "errors": dict(stats.errors),
+            "latency_counts": list(stats.latency_counts),
+            "latency_sum": stats.latency_sum,
+            "restarts": delegate.restarts,
+            "worker": None if delegate.active_handle is None else worker_ids(delegate.active_handle),
+        }
+
+    log_handlers = {}
+    for name, logger in list(logging.Logger.manager.loggerDict.items()):
+        for handler in getattr(logger, "handlers", ()):
+            if isinstance(handler, BackgroundLogHandler):
+                log_handlers[name] = {
+                    "queue_depth": handler.queue_depth, "dropped": handler.dropped}
+
+    return {
+        "services": services,
+        "log_handlers": log_handlers,
+        "data_logger": None if data_logger is None else dict(
+            data_logger.metrics(), native_id=data_logger.writer.native_id),
+        "scheduler": None if service_manager.scheduler is None else service_manager.scheduler.stats(),
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(name, _escape(value)) for name, value in labels.items()) + "}"
+
+
+class _Metrics:
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, kind, doc, samples):
+        """samples of (labels, value), or (suffix, labels, value) for a histogram."""
+        samples = [sample for sample in samples if sample[-1] is not None]
+        if not samples:
+            return
+
+        self.lines.append("# HELP {} {}".format(name, doc))
+        self.lines.append("# TYPE {} {}".format(name, kind))
+
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+            value = int(value) if isinstance(value, (bool, int)) else float(value)
+            self.lines.append("{}{}{} {}".format(name, suffix, _labels(labels), value))
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render(snapshot):
+    """The Prometheus text for a collect() snapshot."""
+    metrics = _Metrics()
+    services = snapshot["services"]
+
+    metrics.add("sensing_service_up", "gauge", "1 if the service is running.",
+                [({"service": s}, info["up"]) for s, info in services.items()])
+    metrics.add("sensing_service_health", "gauge", "0 ok, 1 unhealthy but answering, 2 dead.",
+                [({"service": s}, info["health"]) for s, info in services.items()])
+    metrics.add("sensing_service_sample_rate", "gauge",
+                "Samples received per second over the health window.",
+                [({"service": s}, info["sample_rate"]) for s, info in services.items()])
+    metrics.add("sensing_service_samples_total", "counter", "Samples received.",
+                [({"service": s}, info["samples"]) for s, info in services.items()])
+    metrics.add("sensing_service_errors_total", "counter", "Failed requests and samples, by kind.",
+                [({"service": s, "kind": kind}, n)
+                 for s, info in services.items() for kind, n in info["errors"].items()])
+    metrics.add("sensing_service_restarts_total", "counter", "Restarts attempted.",
+                [({"service": s}, info["restarts"]) for s, info in services.items()])
+
+    latency = []
+    for s, info in services.items():
+        count = 0
+        for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), info["latency_counts"]):
+            count += n
+            latency.append(("_bucket", {"service": s, "le": bound}, count))
+        latency.append(("_sum", {"service": s}, info["latency_sum"]))
+        latency.append(("_count", {"service": s}, count))
+    metrics.add("sensing_service_request_latency_seconds", "histogram",
+                "Time from request to reply.", latency)
+
+    # the client, its writer thread and each service's worker, which is a
+    # process of its own or a thread of the client
+    pid = os.getpid()
+    processes = [({"process": "client"}, pid)]
+    threads = []
+    if snapshot["data_logger"] is not None:
+        threads.append(({"thread": "data_logger"}, pid, snapshot["data_logger"]["native_id"]))
+    for s, info in services.items():
+        if info["worker"] is None:
+            continue
+        worker_pid, tid = info["worker"]
+        if tid is None:
+            processes.append(({"process": s}, worker_pid))
+        else:
+            threads.append(({"thread": s}, worker_pid, tid))
+
+    metrics.add("sensing_process_cpu_seconds_total", "counter", "User and system cpu time.",
+                [(labels, cpu_seconds(p)) for labels, p in processes])
+    metrics.add("sensing_process_resident_memory_bytes", "gauge", "Resident memory.",
+                [(labels, rss_bytes(p)) for labels, p in processes])
+    metrics.add("sensing_thread_cpu_seconds_total", "counter",
+                "User and system cpu time of a thread of the client.",
+                [(labels, cpu_seconds(p, tid)) for labels, p, tid in threads])
+
+    data_logger = snapshot["data_logger"]
+    if data_logger is not None:
+        metrics.add("sensing_data_logger_queue_depth", "gauge", "Rows waiting for the writer.",
+                    [({}, data_logger["queue_depth"])])
+        metrics.add("sensing_data_logger_rows_written_total", "counter", "Rows written.",
+                    [({}, data_logger["rows_written"])])
+        metrics.add("sensing_data_logger_rows_dropped_total", "counter",
+                    "Rows dropped, the queue being full or a write failing.",
+                    [({}, data_logger["rows_dropped"])])
+        metrics.add("sensing_data_logger_bytes_written_total", "counter",
+                    "Bytes written, before any compression of closed segments.",
+                    [({}, data_logger["bytes_written"])])
+        metrics.add("sensing_data_logger_flush_seconds", "gauge", "Time the last write took.",
+                    [({}, data_logger["last_flush_latency_ms"] / 1000)])
+
+    log_handlers = snapshot["log_handlers"]
+    metrics.add("sensing_log_queue_depth", "gauge", "Log records waiting to be written.",
+                [({"logger": name}, info["queue_depth"]) for name, info in log_handlers.items()])
+    metrics.add("sensing_log_records_dropped_total", "counter",
+                "Log records dropped, the queue being full.",
+                [({"logger": name}, info["dropped"]) for name, info in log_handlers.items()])
+
+    scheduler = snapshot["scheduler"]
+    if scheduler is not None:
+        metrics.add("sensing_scheduler_ticks_total", "counter", "Rows due.",
+                    [({}, scheduler["ticks"])])
+        metrics.add("sensing_scheduler_skipped_ticks_total", "counter",
+                    "Rows skipped by falling behind.", [({}, scheduler["skipped_ticks"])])
+        metrics.add("sensing_scheduler_p99_jitter_seconds", "gauge",
+                    "99th percentile of recent lateness of ticks.",
+                    [({}, scheduler["p99_jitter_ms"] / 1000)])
+
+    return metrics.text()
+
+
+class MetricsServer:
+    """
+    Serves /metrics from a daemon thread. Each scrape has the event loop
+    take a collect() snapshot, between its other work, then renders it on
+    the server's thread.
+    """
+
+    def __init__(self, collect_snapshot, loop, host, port, logger=None):
+        self.collect_snapshot = collect_snapshot
+        self.loop = loop
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                try:
+                    body = server.scrape().encode()
+                except Exception as e:
+                    server.logger.warning("Metrics scrape failed: %s", e)
+                    self.send_error(503)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                server.logger.debug("Metrics %s: " + format, self.client_address[0], *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="MetricsServer", daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    async def _collect(self):
+        return self.collect_snapshot()
+
+    def scrape(self):
+        snapshot = asyncio.run_coroutine_threadsafe(
+            self._collect(), self.loop).result(COLLECT_TIMEOUT)
+
+        return render(snapshot)
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
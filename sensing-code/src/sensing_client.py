@@ -1,52 +1,140 @@
 import asyncio
-import csv
 from time import sleep
-from rich.console import Console
 import signal
 import logging
 import pathlib
 import time
 
 
-from datetime import datetime
-
-
-from .utils.logging_utils import get_cur_logger_dir
+from .utils.logging_utils import configure_logger, get_cur_logger_dir
 
 import subprocess
 from subprocess import DEVNULL
 
 from src.sensor_services.sensing_service_manager import SensingServiceManager
+from src.sensor_services.schema import Field, Schema
+from src.storage.writer import BackgroundWriter, DurabilityPolicy
+from src.storage.rotation import RotatingBackend, RotationPolicy
 
 
 # 10 samples a second
 SAMPLE_RATE = 5
 
+# services with their own sample_rate are sampled at that instead, and
+# merged into rows at SAMPLE_RATE by either "carry_forward" (latest value,
+# with its age in <service>_age_s) or "interpolate"
+MERGE_MODE = "carry_forward"
+
+
+# "chunked" (compressed columnar, see storage/chunked_backend.py) or "csv"
+STORAGE_BACKEND = "chunked"
+STORAGE_BACKENDS = ("chunked", "csv")
+
+# rows are written out by a background thread every FLUSH_ROWS rows or
+# FLUSH_MS milliseconds, whichever comes first, and on shutdown. With
+# FSYNC each write is also fsync'd, so it survives power loss, at the cost
+# of some SD card wear. Segments are fsync'd as they're closed regardless.
+FLUSH_ROWS = 100
+FLUSH_MS = 10000
+FSYNC = True
+
+# a new data/<date>/<HH_MM> segment is started every SEGMENT_SECONDS or
+# once one reaches SEGMENT_BYTES. Closed CSV segments are gzipped, and the
+# oldest segments are deleted whenever free space drops below MIN_FREE_BYTES
+SEGMENT_SECONDS = 60 * 60
+SEGMENT_BYTES = 64 * 1024 * 1024
+COMPRESS_SEGMENTS = True
+MIN_FREE_BYTES = 256 * 1024 * 1024
+
+# with a port, metrics are served at http://<host>:<port>/metrics in the
+# Prometheus text format (see metrics_server.py). Off by default; all
+# interfaces so units in the field can be scraped remotely
+METRICS_PORT = None
+METRICS_HOST = "0.0.0.0"
+
+
+def parse_args(argv=None):
+    """Command line options of the run_client entry points."""
+    import argparse
+    from .sensor_services.merge import MERGE_MODE as MERGE_MODES
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--on-reboot", action="store_true",
+                        help="started by run_on_reboot.py")
+    parser.add_argument("--streaming", action="store_true",
+                        help="have services stream their readings instead of polling them")
+    parser.add_argument("--storage-backend", choices=STORAGE_BACKENDS, default=STORAGE_BACKEND)
+    parser.add_argument("--csv", dest="storage_backend", action="store_const", const="csv",
+                        help="short for --storage-backend csv")
+    parser.add_argument("--merge-mode", default=MERGE_MODE,
+                        choices=(MERGE_MODES.CARRY_FORWARD, MERGE_MODES.INTERPOLATE))
+    parser.add_argument("--interpolate", dest="merge_mode", action="store_const",
+                        const=MERGE_MODES.INTERPOLATE, help="short for --merge-mode interpolate")
+    # serve metrics, see metrics_server.py
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+
+    return parser.parse_args(argv)
+
+
+def get_storage_backend(name):
+    if name == "csv":
+        from .storage.csv_backend import CsvBackend
+        return CsvBackend
+    if name == "chunked":
+        from .storage.chunked_backend import ChunkedBackend
+        return ChunkedBackend
+
+    raise ValueError("Unknown storage backend {}".format(name))
+
 
 class DataLogger:
 
-    def __init__(self, filename, all_keys):
+    def __init__(self, data_dir, schema, backend=STORAGE_BACKEND, policy=None, rotation=None):
+
+        self.schema = Schema([Field("time_ms", "f8", unit="s")]) + schema
+
+        if policy is None:
+            policy = DurabilityPolicy(
+                flush_rows=FLUSH_ROWS, flush_ms=FLUSH_MS, fsync=FSYNC)
+
+        if rotation is None:
+            rotation = RotationPolicy(
+                max_segment_seconds=SEGMENT_SECONDS, max_segment_bytes=SEGMENT_BYTES,
+                compress_closed=COMPRESS_SEGMENTS, min_free_bytes=MIN_FREE_BYTES)
+
+        if backend not in STORAGE_BACKENDS:
+            raise ValueError("Unknown storage backend {}".format(backend))
 
-        self.handle = open(filename, "a")
-        self.dict_keys = ["time_ms", *all_keys]
+        # opened on the writer thread, so the backend's imports (numpy for
+        # the chunked format) don't hold up the first sample
+        def open_backend():
+            return RotatingBackend(data_dir, get_storage_backend(backend), self.schema, rotation)
 
-        self.wrtr = csv.DictWriter(self.handle, self.dict_keys)
-        self.wrtr.writeheader()  # write once
+        self.writer = BackgroundWriter(open_backend, policy)
+        self.writer.start()
 
     def print(self, data):
 
-        data["time_ms"] = time.time()
+        # streamed rows are already stamped with their aligned tick time
+        data.setdefault("time_ms", time.time())
 
-        # if self.handle.tell() == 0: always write header
+        self.writer.put(data)
 
-        self.wrtr.writerow(data)
-        self.handle.flush()
+    def flush(self):
+        self.writer.flush()
 
-    def __del__(self):
-        self.handle.close()
+    def metrics(self):
+        return self.writer.metrics()
+
+    def close(self):
+        if self.writer is None:
+            return
+
+        self.writer.close()
+        self.writer = None
 
-        del self.handle
-        del self.wrtr
+    def __del__(self):
+        self.close()
 
 
 class SensingClient:
@@ -57,35 +145,52 @@ class SensingClient:
 
     last_data = None
 
-    def __init__(self, service_manager: SensingServiceManager):
+    _console = None
+
+    _err_console = None
+
+    def __init__(self, service_manager: SensingServiceManager, streaming=False, storage_backend=STORAGE_BACKEND, merge_mode=MERGE_MODE, metrics_port=METRICS_PORT):
 
         # cop out, i know
         # time.sleep(15)
 
-        self.console = Console()
-        self.err_console = Console(stderr=True)
         # self.loop = asyncio.get_running_loop()
 
         self.service_manager = service_manager
+        self.streaming = streaming
+        self.storage_backend = storage_backend
+        self.merge_mode = merge_mode
+        self.metrics_port = metrics_port
         # self.service_manager.start_service("example_service")
 
         signal.signal(signal.SIGINT, self.sigint_handler)
+        # e.g. systemd/tmux shutting us down, exit the same way so the
+        # data logger writes out what it has buffered
+        signal.signal(signal.SIGTERM, self.sigint_handler)
 
         asyncio.run(self.run())
 
-    def get_data_logger(self):
-
-        keys = []
-        for service in self.service_manager.registered_services.values():
-            keys += list(service.service_class.get_keys())
+    @property
+    def console(self):
+        # rich is slow to import and the headless path never prints with it
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console()
+        return self._console
+
+    @property
+    def err_console(self):
+        if self._err_console is None:
+            from rich.console import Console
+            self._err_console = Console(stderr=True)
+        return self._err_console
 
-        logfile_dir = "data/{}".format(
-            datetime.now().strftime("%Y%m%d"))
+    def get_data_logger(self):
 
-        logfile = logfile_dir + \
-            "/{}.csv".format(datetime.now().strftime("%H_%M"))
+        schema = self.service_manager.get_output_schema(self.merge_mode)
 
-        return DataLogger(logfile, keys)
+        # segments go in data/<date>/<HH_MM>, rotated by the logger
+        return DataLogger("data", schema, backend=self.storage_backend)
 
     async def run(self):
 
@@ -93,19 +198,53 @@ class SensingClient:
 
         data_logger = self.get_data_logger()
 
+        metrics_server = None
+        if self.metrics_port is not None:
+            metrics_server = self.start_metrics_server(data_logger)
+
         last_speak = None
 
         await self.service_manager.start()
 
-        async for sensor_data in self.service_manager.monitor_services(sample_rate=SAMPLE_RATE):
+        try:
+            async for sensor_data in self.service_manager.monitor_services(
+                    sample_rate=SAMPLE_RATE, streaming=self.streaming, merge_mode=self.merge_mode):
+
+                self.last_data = sensor_data
 
-            self.last_data = sensor_data
+                data_logger.print(sensor_data)
 
-            data_logger.print(sensor_data)
+                if last_speak is None or time.time() - last_speak > 30:
+                    self.speak()
+                    self.get_logger().info(
+                        "Data logger: %s", data_logger.metrics())
+                    self.get_logger().info(
+                        "Scheduler: %s", self.service_manager.scheduler.stats())
+                    self.get_logger().info(
+                        "Services: %s", self.service_manager.get_service_stats())
+                    last_speak = time.time()
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
 
-            if last_speak is None or time.time() - last_speak > 30:
-                self.speak()
-                last_speak = time.time()
+            # write out whatever is still buffered
+            data_logger.close()
+
+            # let the sensors tear down rather than die with the client
+            await self.service_manager.stop_services()
+
+    def start_metrics_server(self, data_logger):
+        # http.server is only needed with metrics on
+        from .metrics_server import MetricsServer, collect
+
+        metrics_server = MetricsServer(
+            lambda: collect(self.service_manager, data_logger),
+            asyncio.get_running_loop(), METRICS_HOST, self.metrics_port, self.get_logger())
+        metrics_server.start()
+
+        self.get_logger().info("Serving metrics on port %s", metrics_server.port)
+
+        return metrics_server
 
     def sigint_handler(self, _, _1):
         print("CTRL+C pushed")
@@ -126,8 +265,6 @@ class SensingClient:
 
         logfile = logfile_dir + "/general.log"
 
-        self._logger.setLevel(logging.DEBUG)
-
         filehandler = logging.FileHandler(
             logfile
         )
@@ -139,7 +276,8 @@ class SensingClient:
 
         filehandler.setFormatter(formatter)
 
-        self._logger.addHandler(filehandler)
+        # written from a thread of its own, see BackgroundLogHandler
+        configure_logger(self._logger, filehandler)
 
         return self._logger
 
@@ -171,10 +309,10 @@ class SensingClient:
                                 self.last_data) + ". "
                     except Exception as e:
 
-                        logger.critical("Failed to speak data {}".format(e))
+                        logger.critical("Failed to speak data %s", e)
 
             print(message)
             subprocess.Popen(["espeak", "\"{}\"".format(
                 message)], stdout=DEVNULL, stderr=DEVNULL)
         except Exception as e:
-            logger.critical("Failed to speak data {}".format(e))
+            logger.critical("Failed to speak data %s", e)
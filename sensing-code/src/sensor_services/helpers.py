@@ -1,5 +1,13 @@
 import time
 
+from ..utils.status_utils import STATUS_MESSAGES
+
+# how long a worker has to answer STOP (after its teardown) with STOP_ACK
+STOP_TIMEOUT = 2
+
+# how long each of exiting, terminate and kill get to end the worker
+EXIT_TIMEOUT = 1
+
 
 class SERVICE_STATUS:
     STOPPED_ILL = -1
@@ -7,6 +15,7 @@ class SERVICE_STATUS:
     RUNNING = 1
     STOPPED = 2
     WAITING_TO_REBOOT = 3
+    STARTING = 4
 
 
 class SensingServiceHandle:
@@ -24,10 +33,38 @@ class SensingServiceHandle:
         return "SensingServiceHandle(send_pipe={}, recv_pipe={}, process={}, last_error={})".format(
             self.send_pipe, self.recv_pipe, self.process, self.last_error)
 
-    def __del__(self):
+    def close(self, seq=None, stop_timeout=STOP_TIMEOUT, on_step=None):
+        """
+        Stop the worker, escalating until it's gone: ask it to STOP and wait
+        for its STOP_ACK (sent once it's torn down), then wait for it to
+        exit, then terminate it, then kill it. Then close the pipes.
 
-        self.process.terminate()
-        self.process.join()
+        Blocks for up to stop_timeout + 3 * EXIT_TIMEOUT, so from async
+        code run it in an executor. Each step is passed to on_step as
+        (step, seconds, succeeded), and all of them are returned.
+        """
+        steps = []
+
+        if self.process is None:
+            return steps
+
+        def step(name, fn, *args):
+            start = time.time()
+            succeeded = fn(*args)
+            steps.append((name, time.time() - start, succeeded))
+            if on_step is not None:
+                on_step(name, time.time() - start, succeeded)
+            return succeeded
+
+        # a worker which failed to start has nothing to stop (and can't be
+        # joined), only the pipes to close
+        if self.process.ident is not None:
+            step("stop", self._stop, seq, stop_timeout)
+
+            # if all fail, the worker is abandoned (see abandoned())
+            step("exit", self._join, EXIT_TIMEOUT) or \
+                step("terminate", self._terminate) or \
+                step("kill", self._kill)
 
         try:
             self.send_pipe.close()
@@ -35,14 +72,59 @@ class SensingServiceHandle:
         except Exception as e:
             print(e)
 
-        del self.send_pipe
-        del self.recv_pipe
-        del self.process
+        self.process = None
+
+        return steps
+
+    @staticmethod
+    def abandoned(steps):
+        """Whether close() gave up on the worker, from the steps it returned."""
+        return bool(steps) and not steps[-1][2]
+
+    def _stop(self, seq, timeout):
+        """Send STOP, True once the STOP_ACK is back."""
+        try:
+            self.send_pipe.send((STATUS_MESSAGES.STOP.value, seq, None))
+        except (OSError, ValueError):
+            # already gone
+            return False
+
+        deadline = time.time() + timeout
+        try:
+            while self.recv_pipe.poll(max(0, deadline - time.time())):
+                # anything else, e.g. a last stream batch, is dropped
+                if self.recv_pipe.recv()[0] == STATUS_MESSAGES.STOP_ACK.value:
+                    return True
+        except (EOFError, OSError):
+            pass
+
+        return False
+
+    def _join(self, timeout):
+        self.process.join(timeout)
+        return not self.process.is_alive()
+
+    def _terminate(self):
+        self.process.terminate()
+        return self._join(EXIT_TIMEOUT)
+
+    def _kill(self):
+        # a thread can't be killed
+        if not hasattr(self.process, "kill"):
+            return False
+
+        self.process.kill()
+        return self._join(EXIT_TIMEOUT)
+
+    def __del__(self):
+        self.close()
 
 
 class ServiceError(Exception):
 
-    def __init__(self, msg, critical=False) -> None:
+    def __init__(self, msg, critical=False, kind="error") -> None:
         super().__init__(msg)
         self.time = time.time()
         self.critical = critical
+        # what went wrong, e.g. "data_error", for the service's stats
+        self.kind = kind
@@ -1,10 +1,21 @@
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
 
 
 class CO2Service(SensingService):
 
     __id__ = "co2_service"
 
+    schema = Schema([
+        Field("eco2", "i4", unit="ppm"),
+        Field("tvoc", "i4", unit="ppb")
+    ])
+
+    # the CCS811 measures once a second in its default drive mode
+    sample_rate = 1
+
+    preload_modules = ("busio", "adafruit_ccs811", "board")
+
     i2c_address = None
 
     sensor = None
@@ -41,10 +52,6 @@ class CO2Service(SensingService):
             "tvoc": self.sensor.tvoc
         }
 
-    @staticmethod
-    def get_keys():
-        return ["eco2", "tvoc"]
-
     @staticmethod
     def speak_data(data):
         if data is None or not isinstance(data, dict):
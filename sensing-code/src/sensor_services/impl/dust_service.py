@@ -1,15 +1,296 @@
+from operator import itemgetter
+import select
+import struct
+import sys
+import time
+
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
+
+
+# columns of a POPS UDP line, see the POPS manual. Followed by the
+# histogram bins b0 ... b{nbins - 1}
+POPS_COLUMNS = [
+    "MagicPops", "MagicPopsVersion", "CsvFileName",
+    # csv headers:
+    "DateTime", "TimeSSM", "Status", "DateStatus", "PartCt", "HistSum", "PartCon", "BL", "BLTH", "STD", "MaxSTD", "P", "TofP", "PumpLife_hrs", "WidthSTD", "AveWidth", "POPS_Flow",
+    "PumpFB", "LDTemp", "LaserFB", "LD_Mon", "Temp", "BatV", "Laser_Current", "Flow_Set", "BL_Start", "TH_Mult", "nbins", "logmin", "logmax", "Skip_Save", "MinPeakPts", "MaxPeakPts", "RawPts"
+]
+
+POPS_VERSION = "POPS-220"
+
+NBINS_COLUMN = POPS_COLUMNS.index("nbins")
+
+# Linux socket options for the ancillary data received with each datagram,
+# not exposed by the socket module: the kernel's receive time (a timespec)
+# and its running count of datagrams dropped because the receive buffer
+# was full (a u32)
+if sys.platform.startswith("linux"):
+    SO_TIMESTAMPNS = 35
+    SO_RXQ_OVFL = 40
+else:
+    SO_TIMESTAMPNS = SO_RXQ_OVFL = None
+
+TIMESPEC = struct.Struct("@ll")
+DROP_COUNT = struct.Struct("@I")
+
+# a capture of received datagrams is a sequence of these, each followed by
+# the datagram: (arrival time, datagram length)
+CAPTURE_RECORD = struct.Struct("<dI")
+
+# time (s) left for a reply to get back to main before its deadline
+REPLY_MARGIN = 0.05
+
+
+def read_capture(filename):
+    """The (arrival time, datagram) pairs of a capture file, in order."""
+    datagrams = []
+
+    with open(filename, "rb") as f:
+        while True:
+            header = f.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                break
+
+            arrival, length = CAPTURE_RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # cut short by a crash, as with the data files
+                break
+
+            datagrams.append((arrival, data))
+
+    return datagrams
+
+
+class PopsLayout:
+    """
+    How to turn the columns of one shape of POPS line into a typed
+    sample: the columns are grouped by type, so each group is picked out
+    with one itemgetter and converted with one map.
+    """
+
+    def __init__(self, schema, nbins, n_columns):
+        self.columns = POPS_COLUMNS + ["b{}".format(i) for i in range(nbins)]
+        self.matches = len(self.columns) == n_columns
+
+        converters = {}
+        for field in schema.fields:
+            # strings are already strings
+            convert = None if field.kind == "U" else (
+                int if field.kind in "iu" else field.convert)
+            for key in field.keys:
+                converters[key] = convert
+
+        groups = {}
+        for i, key in enumerate(self.columns[:n_columns]):
+            # e.g. bins past the schema's width
+            if key not in converters:
+                continue
+            indices, keys = groups.setdefault(converters[key], ([], []))
+            indices.append(i)
+            keys.append(key)
+
+        # keys in the order the groups produce their values
+        self.keys = []
+        self.groups = []
+        for convert, (indices, keys) in groups.items():
+            # itemgetter of one index returns the item, not a tuple
+            getter = itemgetter(*indices) if len(indices) > 1 else \
+                (lambda values, i=indices[0]: (values[i],))
+            self.groups.append((getter, convert))
+            self.keys += keys
+
+
+class PopsParser:
+    """
+    Parses POPS UDP datagrams into samples of native typed values. The
+    layout for each (firmware version, nbins, column count) is worked out
+    once and cached, so a packet costs a split and a few maps.
+    """
+
+    def __init__(self, schema, logger=None):
+        self.schema = schema
+        self.logger = logger
+
+        self._layouts = {}
+
+        # datagrams which couldn't be parsed
+        self.errors = 0
+
+    def _get_layout(self, values):
+        key = (values[1], values[NBINS_COLUMN], len(values))
+
+        layout = self._layouts.get(key)
+        if layout is not None:
+            return layout
+
+        version, nbins, n_columns = key
+
+        try:
+            nbins = int(nbins)
+        except ValueError:
+            raise ValueError(
+                "Invalid number of bins in data sensor reading {}".format(nbins))
+
+        layout = PopsLayout(self.schema, nbins, n_columns)
+
+        if self.logger is not None:
+            if version != POPS_VERSION:
+                self.logger.warning(
+                    "Invalid magic value %s!='%s'. This may indicate the dust sensor is using a different/updated firmware. It may cause no issues, but be aware!", version, POPS_VERSION)
+            if not layout.matches:
+                self.logger.warning(
+                    "Predicted length of data sensor data doesn't match actual length")
+
+        self._layouts[key] = layout
+        return layout
+
+    def parse(self, datagram):
+        """Parse the first line of one datagram."""
+        values = datagram.split(b"\r\n", 1)[0].decode("utf-8").split(",")
+
+        if values[0] != "POPS" or len(values) <= NBINS_COLUMN:
+            raise ValueError("Failed to get magic value 'POPS'")
+
+        layout = self._get_layout(values)
+
+        converted = []
+        try:
+            for getter, convert in layout.groups:
+                picked = getter(values)
+                converted.extend(picked if convert is None else map(convert, picked))
+        except (ValueError, TypeError):
+            # a malformed value, convert field by field with fills instead
+            return self.schema.coerce(dict(zip(layout.columns, values)))
+
+        return dict(zip(layout.keys, converted))
+
+    def parse_many(self, datagrams):
+        """
+        Parse several queued datagrams, one sample for each, None for (and
+        counting) any that can't be parsed.
+        """
+        samples = []
+
+        for datagram in datagrams:
+            try:
+                samples.append(self.parse(datagram))
+            except ValueError as e:
+                self.errors += 1
+                samples.append(None)
+                if self.logger is not None:
+                    self.logger.warning("Dropped unparseable datagram: %s", e)
+
+        return samples
 
 
 class DustService(SensingService):
+    """
+    The POPS dust sensor, which sends each reading as a UDP datagram.
+
+    Every queued datagram is read and parsed (read_samples when streaming),
+    but the data file only gets one sample per row: the newest at the
+    row's tick (see get_merged_data). The rest are counted in rx_skipped
+    when polled, or dropped from the stream buffer when streamed. To keep
+    every datagram, set capture_file, which records them all as received
+    (see read_capture and PopsReplayService).
+    """
 
     __id__ = "dust_service"
 
+    # column layout of the POPS UDP output, see the POPS manual
+    schema = Schema([
+        Field("MagicPops", "U4"),
+        Field("MagicPopsVersion", "U16"),
+        Field("CsvFileName", "U64"),
+        # csv headers:
+        Field("DateTime", "U32"),
+        Field("TimeSSM", "f8", unit="s"),
+        Field("Status", "i4"),
+        Field("DateStatus", "i4"),
+        Field("PartCt", "i4", unit="#"),
+        Field("HistSum", "i4", unit="#"),
+        Field("PartCon", "f8", unit="#/cm3"),
+        Field("BL", "i4"),
+        Field("BLTH", "i4"),
+        Field("STD", "f8"),
+        Field("MaxSTD", "f8"),
+        Field("P", "f8", unit="hPa"),
+        Field("TofP", "f8", unit="C"),
+        Field("PumpLife_hrs", "f8", unit="h"),
+        Field("WidthSTD", "f8"),
+        Field("AveWidth", "f8"),
+        Field("POPS_Flow", "f8", unit="cm3/s"),
+        Field("PumpFB", "i4"),
+        Field("LDTemp", "f8", unit="C"),
+        Field("LaserFB", "i4"),
+        Field("LD_Mon", "i4"),
+        Field("Temp", "f8", unit="C"),
+        Field("BatV", "f8", unit="V"),
+        Field("Laser_Current", "f8", unit="mA"),
+        Field("Flow_Set", "f8", unit="cm3/s"),
+        Field("BL_Start", "i4"),
+        Field("TH_Mult", "f8"),
+        Field("nbins", "i4"),
+        Field("logmin", "f8"),
+        Field("logmax", "f8"),
+        Field("Skip_Save", "i4"),
+        Field("MinPeakPts", "i4"),
+        Field("MaxPeakPts", "i4"),
+        Field("RawPts", "i4"),
+        # ... followed by bins starting at b0 -> b[nbins -1]
+        Field("b", "u4", unit="#", width=16, count="nbins"),
+        # receive side counters, since startup: datagrams the kernel
+        # dropped with the socket's buffer full, and datagrams read but
+        # not returned because a newer one was queued behind them
+        Field("rx_overflow", "u4", unit="#"),
+        Field("rx_skipped", "u4", unit="#")
+    ])
+
+    # the POPS sends a reading a second
+    sample_rate = 1
+
+    # parses every datagram the POPS sends, keep that off the client's GIL
+    isolated = True
+
+    # the parser already produces schema typed values
+    coerce_samples = False
+
+    parser = None
+
     udp_ip = "10.11.97.100"
     udp_port = 10080
 
+    # SO_RCVBUF to ask for, so bursts queue up rather than overflow while
+    # the worker is busy. None keeps the system default. Overridable with
+    # the "rcvbuf_bytes" config value
+    rcvbuf_bytes = 1 << 20
+
+    # largest datagram read, longer ones are truncated
+    max_datagram_bytes = 4096
+
+    # most datagrams one read drains, so a sender which keeps up with the
+    # draining can't keep it from returning
+    max_datagrams_per_read = 1000
+
+    # how long read_data waits for a datagram when none are queued, cut
+    # short to answer main's request in time (less REPLY_MARGIN)
+    read_timeout = 1
+
+    # file every received datagram is appended to, for replaying later
+    # with PopsReplayService. Set with the "capture_file" config value
+    capture_file = None
+
     sock = None
 
+    _capture = None
+
+    _ancillary_bufsize = 0
+
+    rx_overflow = 0
+    rx_skipped = 0
+
     def configure(self, config):
         if config is not None:
             if "udp_ip" in config:
@@ -18,8 +299,14 @@ class DustService(SensingService):
             if "udp_port" in config:
                 self.udp_port = config["udp_port"]
 
+            if "rcvbuf_bytes" in config:
+                self.rcvbuf_bytes = config["rcvbuf_bytes"]
+
+            if "capture_file" in config:
+                self.capture_file = config["capture_file"]
+
         self.get_logger().debug(
-            "Configured sensor with udp address {}:{}".format(self.udp_ip, self.udp_port))
+            "Configured sensor with udp address %s:%s", self.udp_ip, self.udp_port)
 
     def startup(self):
         try:
@@ -30,84 +317,139 @@ class DustService(SensingService):
         logger = self.get_logger()
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        if self.rcvbuf_bytes is not None:
+            self.sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf_bytes)
+        logger.info("Receive buffer is %s bytes",
+                    self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF))
+
+        self._ancillary_bufsize = 0
+        for option, size in ((SO_TIMESTAMPNS, TIMESPEC.size), (SO_RXQ_OVFL, DROP_COUNT.size)):
+            if option is None:
+                continue
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, 1)
+                self._ancillary_bufsize += socket.CMSG_SPACE(size)
+            except OSError as e:
+                logger.warning(
+                    "Socket option %s not supported: %s", option, e)
+
+        # reads drain the queue, and stop when it's empty
+        self.sock.setblocking(False)
+
         try:
             self.sock.bind((self.udp_ip, self.udp_port))
         except OSError:
             raise Exception(
                 "Unable to bind to requested address, ensure you have configured the raspberry pi's network as defined in POPS manual.")
-        logger.info("Succesfully bound to socket {}:{}".format(
-            self.udp_ip, self.udp_port))
+        logger.info("Succesfully bound to socket %s:%s", self.udp_ip, self.udp_port)
+
+        self.parser = PopsParser(self.schema, logger)
+
+        if self.capture_file is not None:
+            self._capture = open(self.capture_file, "ab")
+            logger.info("Capturing datagrams to %s", self.capture_file)
+
+    def get_wait_handles(self):
+        if self.sock is None:
+            return []
+        return [self.sock]
 
     def teardown(self):
         if self.sock is not None:
             self.sock.close()
 
-    def read_data(self):
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
+    def _drain(self):
+        """
+        Read every datagram queued on the socket (up to
+        max_datagrams_per_read), without blocking, as (arrival time,
+        datagram) pairs, oldest first. The arrival time is
+        the kernel's where it gives one.
+        """
+        import socket
+
+        datagrams = []
+
+        while len(datagrams) < self.max_datagrams_per_read:
+            try:
+                data, ancdata, _, _ = self.sock.recvmsg(
+                    self.max_datagram_bytes, self._ancillary_bufsize)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            arrival = None
+            for level, kind, cdata in ancdata:
+                if level != socket.SOL_SOCKET:
+                    continue
+                if kind == SO_TIMESTAMPNS and len(cdata) >= TIMESPEC.size:
+                    sec, nsec = TIMESPEC.unpack_from(cdata)
+                    arrival = sec + nsec / 1e9
+                elif kind == SO_RXQ_OVFL and len(cdata) >= DROP_COUNT.size:
+                    # running total, only sent once there have been drops
+                    self.rx_overflow = DROP_COUNT.unpack_from(cdata)[0]
+
+            if arrival is None:
+                arrival = time.time()
+
+            datagrams.append((arrival, data))
+
+            if self._capture is not None:
+                self._capture.write(CAPTURE_RECORD.pack(arrival, len(data)) + data)
+
+        return datagrams
+
+    def _add_rx_counts(self, sample):
+        sample["rx_overflow"] = self.rx_overflow
+        sample["rx_skipped"] = self.rx_skipped
+        return sample
+
+    def read_samples(self):
 
-        logger = self.get_logger()
         if self.sock is None:
             raise Exception("no Socket!")
 
-        data, addr = self.sock.recvfrom(1024)
+        datagrams = self._drain()
 
-        s_data = data.decode('utf-8')
+        parsed = self.parser.parse_many([data for _, data in datagrams])
 
-        cols = [
-            "MagicPops", "MagicPopsVersion", "CsvFileName",
-            # csv headers:
+        samples = [(arrival, self._add_rx_counts(sample))
+                   for (arrival, _), sample in zip(datagrams, parsed) if sample is not None]
 
-            "DateTime", "TimeSSM", "Status", "DateStatus", "PartCt", "HistSum", "PartCon", "BL", "BLTH", "STD", "MaxSTD", "P", "TofP", "PumpLife_hrs", "WidthSTD", "AveWidth", "POPS_Flow",
-            "PumpFB", "LDTemp", "LaserFB", "LD_Mon", "Temp", "BatV", "Laser_Current", "Flow_Set", "BL_Start", "TH_Mult", "nbins", "logmin", "logmax", "Skip_Save", "MinPeakPts", "MaxPeakPts", "RawPts"
-            # ... followed by bins starting at b0 -> b[nbins -1]
-        ]
+        if datagrams and not samples:
+            raise Exception("None of {} datagrams could be parsed".format(
+                len(datagrams)))
 
-        first_line = s_data.split('\r\n')[0]
-        split_first_line = first_line.split(',')
+        return samples
 
-        if split_first_line[0] != 'POPS':
-            raise Exception("Failed to get magic value 'POPS'")
-        if split_first_line[1] != 'POPS-220':
-            logger.warning(
-                "Invalid magic value {}!='POPS-220'. This may indicate the dust sensor is using a different/updated firmware. It may cause no issues, but be aware!")
+    def read_data(self):
 
-        try:
-            nbins = int(split_first_line[cols.index("nbins")])
-        except ValueError:
-            raise Exception("Invalid number of bins in data sensor reading {}".format(
-                split_first_line[cols.index("nbins")]))
-
-        cols += ["b{}".format(i) for i in range(nbins)]
-
-        if len(cols) != len(split_first_line):
-            logger.warning(
-                "Predicted length of data sensor data doesn't match actual length")
-
-        return dict(zip(cols, split_first_line))
-        # logger = self.get_logger()
-        # if self.sensor is None:
-        #     logger.critical(
-        #         "No BME280 sensor is present at time of reading data, has it been deleted by another thread?")
-        #     raise Exception("No PHT Sensor")
-
-        # logger.debug("Read data from sensor, Temp Celcius: {}, Pressure HPa: {}, Humidity RH: {}".format(
-        #     self.sensor.temperature_celsius, float(self.sensor.pressure/1e4), float(self.sensor.humidity)))
-        # return {
-        #     "temp_celcius": float(self.sensor.temperature_celsius),
-        #     "pressure_hpa": float(self.sensor.pressure/1e4),
-        #     "humidity_rh": float(self.sensor.humidity)
-        # }
+        if self.sock is None:
+            raise Exception("no Socket!")
 
-    @staticmethod
-    def get_keys():
-        return [
-            "MagicPops", "MagicPopsVersion", "CsvFileName",
-            # csv headers:
-            "DateTime", "TimeSSM", "Status", "DateStatus", "PartCt", "HistSum", "PartCon", "BL", "BLTH", "STD", "MaxSTD", "P", "TofP", "PumpLife_hrs", "WidthSTD", "AveWidth", "POPS_Flow",
-            "PumpFB", "LDTemp", "LaserFB", "LD_Mon", "Temp", "BatV", "Laser_Current", "Flow_Set", "BL_Start", "TH_Mult", "nbins", "logmin", "logmax", "Skip_Save", "MinPeakPts", "MaxPeakPts",
-            "RawPts",
-            # ... followed by bins starting at b0 -> b[nbins -1]
-            "b0", "b1", "b2", "b3", "b4", "b5", "b6", "b7", "b8", "b9", "b10", "b11", "b12", "b13", "b14", "b15"
-        ]
+        datagrams = self._drain()
+
+        if not datagrams:
+            timeout = self.read_timeout
+            if self.request_deadline is not None:
+                timeout = min(timeout, self.request_deadline - REPLY_MARGIN - time.time())
+
+            readable, _, _ = select.select(
+                [self.sock], [], [], max(0, timeout))
+            if readable:
+                datagrams = self._drain()
+
+        if not datagrams:
+            raise Exception("No datagram from the POPS in time")
+
+        # main wants the current reading, older ones are only counted
+        self.rx_skipped += len(datagrams) - 1
+
+        return self._add_rx_counts(self.parser.parse(datagrams[-1][1]))
 
     @staticmethod
     def speak_data(data):
@@ -1,12 +1,17 @@
 from random import random
 import time
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
 
 
 class ExampleService(SensingService):
 
     __id__ = "example_service"
 
+    schema = Schema([
+        Field("test", "f8", unit="s")
+    ])
+
     def configure(self, config):
         # if random() < 0.1:
         #     raise Exception("AH")
@@ -30,12 +35,6 @@ class ExampleService(SensingService):
     def teardown(self):
         return
 
-    @staticmethod
-    def get_keys():
-        return {
-            "test"
-        }
-
     @staticmethod
     def speak_data(data):
         if data is None or not isinstance(data, dict):
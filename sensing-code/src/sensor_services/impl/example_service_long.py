@@ -1,12 +1,20 @@
 from random import random
 import time
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
 
 
 class ExampleServiceLong(SensingService):
 
     __id__ = "example_service_long"
 
+    schema = Schema([
+        Field("test_long", "f8", unit="s")
+    ])
+
+    # a slow sensor, read_data can take up to 2 s
+    sample_rate = 0.5
+
     def configure(self, config):
         # if random() < 0.1:
         #     raise Exception("AH")
@@ -30,12 +38,6 @@ class ExampleServiceLong(SensingService):
     def teardown(self):
         return
 
-    @staticmethod
-    def get_keys():
-        return [
-            "test_long"
-        ]
-
     @staticmethod
     def speak_data(data):
         if data is None or not isinstance(data, dict):
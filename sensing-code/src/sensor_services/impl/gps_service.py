@@ -1,4 +1,5 @@
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
 from datetime import datetime, timezone
 
 
@@ -6,6 +7,20 @@ class GPSService(SensingService):
 
     __id__ = "gps_service"
 
+    schema = Schema([
+        Field("lon", "f8", unit="deg"),
+        Field("lat", "f8", unit="deg"),
+        Field("time_utc", "f8", unit="s")
+    ])
+
+    # the receiver only has a new fix about once a second
+    sample_rate = 1
+
+    # serial reads from the receiver can block indefinitely
+    isolated = True
+
+    preload_modules = ("ublox_gps", "serial")
+
     serial_port = None
     baud_rate = None
     timeout = None
@@ -65,12 +80,6 @@ class GPSService(SensingService):
             del self.gps
             del self.port
 
-    @staticmethod
-    def get_keys():
-        return [
-            "lon", "lat", "time_utc"
-        ]
-
     @staticmethod
     def speak_data(data):
         if data is None or not isinstance(data, dict):
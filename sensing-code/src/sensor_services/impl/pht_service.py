@@ -1,10 +1,19 @@
 from ..sensing_service import SensingService
+from ..schema import Field, Schema
 
 
 class PHTService(SensingService):
 
     __id__ = "pht_service"
 
+    schema = Schema([
+        Field("temp_celcius", "f8", unit="C"),
+        Field("pressure_hpa", "f8", unit="hPa"),
+        Field("humidity_rh", "f8", unit="%RH")
+    ])
+
+    preload_modules = ("qwiic_bme280",)
+
     i2c_address = None
 
     sensor = None
@@ -44,10 +53,6 @@ class PHTService(SensingService):
             "humidity_rh": float(self.sensor.humidity)
         }
 
-    @staticmethod
-    def get_keys():
-        return ["temp_celcius", "pressure_hpa", "humidity_rh"]
-
     @staticmethod
     def speak_data(data):
         if data is None or not isinstance(data, dict):
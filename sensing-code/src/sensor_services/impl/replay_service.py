@@ -0,0 +1,261 @@
+"""
+Services which replay recorded data through the SensingService interface,
+for benchmarking and regression testing the pipeline without hardware:
+
+    ReplayService.define(PHTService)    rows recorded in data/
+    PopsReplayService                   a capture of POPS datagrams
+
+Both replay at the recorded pace scaled by a speed (1 for real time, N
+for N times faster) or, with a speed of None, as fast as they're read.
+"""
+import threading
+import time
+
+from ..sensing_service import SensingService
+from .dust_service import DustService, read_capture
+
+
+class ReplayClock:
+    """
+    Maps recorded times onto the wall clock, from when it's started, at a
+    speed. Replays which loop carry on from the end of the previous lap.
+    """
+
+    def __init__(self, times, speed):
+        self.times = times
+        self.speed = speed
+
+        self.first = times[0]
+
+        # one lap, plus the mean gap so the first sample of the next lap
+        # isn't on top of the last of this one
+        duration = times[-1] - times[0]
+        self.lap_length = duration + (duration / (len(times) - 1) if len(times) > 1 else 1)
+
+        self.start_time = time.time()
+
+    def wall_time(self, index, lap=0):
+        """When the index'th recorded time is due on the wall clock."""
+        if self.speed is None:
+            return self.start_time
+
+        return self.start_time + (self.times[index] - self.first + lap * self.lap_length) / self.speed
+
+
+class ReplayService(SensingService):
+    """
+    Replays one service's columns of the rows recorded in data_dir, as that
+    service. Build the class for a recorded service with define().
+
+    Config values (all optional):
+        data_dir: where the data was recorded
+        replay_start, replay_end: unix times of the window to replay
+        speed: 1 for real time, N for N times faster, None for max speed
+        loop: start again from the beginning when the window runs out
+    """
+
+    __id__ = "replay_service"
+
+    schema = None
+
+    data_dir = "data"
+    # not start/end, which would hide Process.start
+    replay_start = None
+    replay_end = None
+    speed = 1
+    loop = True
+
+    # rows handed over by one read at max speed
+    max_speed_batch = 100
+
+    # recorded rows are already typed
+    coerce_samples = False
+
+    _rows = None
+    _clock = None
+    _next = 0
+    _lap = 0
+
+    @classmethod
+    def define(cls, service_class, service_id=None):
+        """A ReplayService standing in for service_class, by default under its id."""
+        return type("Replay{}".format(service_class.__name__), (cls,), {
+            "__id__": service_id if service_id is not None else service_class.__id__,
+            "schema": service_class.get_schema(),
+            "speak_data": service_class.speak_data,
+        })
+
+    def configure(self, config):
+        if config is not None:
+            for name in ("data_dir", "replay_start", "replay_end", "speed", "loop"):
+                if name in config:
+                    setattr(self, name, config[name])
+
+        self.get_logger().debug("Configured replay of %s at speed %s",
+                                self.data_dir, "max" if self.speed is None else self.speed)
+
+    def startup(self):
+        # numpy, only for the replay
+        from ...storage.query import read_range
+
+        array = read_range(self.data_dir, self.replay_start, self.replay_end)
+        if array is None:
+            raise Exception("No recorded rows in {} to replay".format(self.data_dir))
+
+        keys = [key for key in self.get_schema().keys if key in array.dtype.names]
+        if not keys:
+            raise Exception("Recorded rows have none of {}'s columns".format(self.__id__))
+
+        self._rows = [dict(zip(keys, row)) for row in array[keys].tolist()]
+
+        self._clock = ReplayClock(array["time_ms"].tolist(), self.speed)
+        self._next = 0
+        self._lap = 0
+
+        self.get_logger().info("Replaying %s rows of %s",
+                               len(self._rows), ", ".join(keys))
+
+    def teardown(self):
+        return
+
+    def _advance(self):
+        """The next row, as (wall time due, row), moving on to the next lap at the end."""
+        if self._next == len(self._rows):
+            if not self.loop:
+                raise Exception("Replay finished")
+            self._next = 0
+            self._lap += 1
+
+        due = self._clock.wall_time(self._next, self._lap)
+        row = self._rows[self._next]
+        self._next += 1
+
+        return due, row
+
+    def _next_due(self):
+        if self._next == len(self._rows):
+            if not self.loop:
+                return None
+            return self._clock.wall_time(0, self._lap + 1)
+        return self._clock.wall_time(self._next, self._lap)
+
+    def read_samples(self):
+        now = time.time()
+        samples = []
+
+        if self.speed is None:
+            while len(samples) < self.max_speed_batch and self._next_due() is not None:
+                samples.append((now, self._advance()[1]))
+            return samples
+
+        while self._next_due() is not None and self._next_due() <= now:
+            samples.append(self._advance())
+
+        return samples
+
+    def read_data(self):
+        next_due = self._next_due()
+        if next_due is None:
+            raise Exception("Replay finished")
+
+        # at max speed every row is due, so hand them over one by one
+        if self.speed is None:
+            return self._advance()[1]
+
+        # nothing due yet, wait for the next row
+        wait = next_due - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+        # the latest row due
+        _, row = self._advance()
+        while self._next_due() is not None and self._next_due() <= time.time():
+            _, row = self._advance()
+
+        return row
+
+
+class PopsReplayService(DustService):
+    """
+    A DustService fed from a capture of POPS datagrams (see DustService's
+    capture_file). A thread sends the captured datagrams to the service's
+    own socket at the captured pace, so the socket draining, drop counting
+    and parsing are all exercised as with the instrument.
+
+    Config values, beyond DustService's:
+        capture_file: the capture to replay (required)
+        speed: 1 for real time, N for N times faster, None for max speed
+        loop: start again from the beginning when the capture runs out
+    """
+
+    udp_ip = "127.0.0.1"
+
+    speed = 1
+    loop = True
+
+    # the capture isn't extended by replaying it
+    replay_file = None
+
+    preload_modules = ()
+
+    _sender = None
+    _stop_sending = None
+
+    def configure(self, config):
+        super().configure(config)
+
+        if config is not None:
+            for name in ("speed", "loop"):
+                if name in config:
+                    setattr(self, name, config[name])
+
+        self.replay_file, self.capture_file = self.capture_file, None
+
+        if self.replay_file is None:
+            raise Exception("No capture_file to replay")
+
+    def startup(self):
+        super().startup()
+
+        datagrams = read_capture(self.replay_file)
+        if not datagrams:
+            raise Exception("No datagrams in {}".format(self.replay_file))
+
+        self._stop_sending = threading.Event()
+        self._sender = threading.Thread(
+            target=self._send, args=(datagrams,), daemon=True)
+        self._sender.start()
+
+        self.get_logger().info("Replaying %s datagrams from %s",
+                               len(datagrams), self.replay_file)
+
+    def _send(self, datagrams):
+        import socket
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        clock = ReplayClock([arrival for arrival, _ in datagrams], self.speed)
+
+        try:
+            lap = 0
+            while not self._stop_sending.is_set():
+                for i, (_, data) in enumerate(datagrams):
+                    wait = clock.wall_time(i, lap) - time.time()
+                    if wait > 0 and self._stop_sending.wait(wait):
+                        return
+
+                    sock.sendto(data, (self.udp_ip, self.udp_port))
+
+                if not self.loop:
+                    return
+                lap += 1
+        except OSError as e:
+            self.get_logger().error("Replay stopped: %s", e)
+        finally:
+            sock.close()
+
+    def teardown(self):
+        if self._stop_sending is not None:
+            self._stop_sending.set()
+            self._sender.join()
+
+        super().teardown()
@@ -0,0 +1,139 @@
+import random
+import time
+
+from ..sensing_service import SensingService
+from ..schema import Field, Schema
+
+
+def synthetic_schema(prefix="", width=4):
+    """A sequence number, when the sample was produced and width values."""
+    return Schema([
+        Field(prefix + "seq", "u8"),
+        Field(prefix + "produced", "f8", unit="s"),
+        Field(prefix + "v", "f8", width=width)
+    ])
+
+
+class SyntheticService(SensingService):
+    """
+    A stand in sensor for load testing the manager, logger and health
+    checks without hardware. Produces samples at a set rate, each read
+    taking a random latency and failing with a set probability.
+
+    Config values (all optional):
+        rate: samples the "sensor" produces per second
+        latency: {"distribution": "fixed" | "uniform" | "exponential" |
+                  "lognormal", "mean": s, "sigma": s} time one read takes
+        failure_rate: probability a read raises
+        seed: for repeatable runs
+
+    The payload width is part of the schema, so is set on the class, see
+    define().
+    """
+
+    __id__ = "synthetic_service"
+
+    schema = synthetic_schema()
+
+    rate = 10
+
+    latency = {"distribution": "fixed", "mean": 0}
+
+    failure_rate = 0
+
+    seed = None
+
+    _random = None
+    _start_time = None
+    _produced = 0
+
+    @classmethod
+    def define(cls, service_id, width=4, **attributes):
+        """
+        A SyntheticService class with its own id and payload width, e.g.
+        for running several at once. Its keys are prefixed with the id so
+        they don't clash. Other attributes (rate, latency, ...) set the
+        defaults config values override.
+        """
+        attributes["__id__"] = service_id
+        attributes["schema"] = synthetic_schema(service_id + "_", width)
+
+        return type("SyntheticService_{}".format(service_id), (cls,), attributes)
+
+    def configure(self, config):
+        if config is not None:
+            for name in ("rate", "latency", "failure_rate", "seed"):
+                if config.get(name) is not None:
+                    setattr(self, name, config[name])
+
+        if self.latency.get("distribution") not in ("fixed", "uniform", "exponential", "lognormal"):
+            raise Exception("Unknown latency distribution {}".format(
+                self.latency.get("distribution")))
+
+        self.get_logger().debug("Configured synthetic sensor at %s Hz, latency %s, failure rate %s",
+                                self.rate, self.latency, self.failure_rate)
+
+    def startup(self):
+        self._random = random.Random(self.seed)
+        self._start_time = time.time()
+        self._produced = 0
+
+    def teardown(self):
+        return
+
+    def _read_latency(self):
+        distribution = self.latency["distribution"]
+        mean = self.latency.get("mean", 0)
+
+        if distribution == "fixed":
+            return mean
+        if distribution == "uniform":
+            return self._random.uniform(0, 2 * mean)
+        if distribution == "exponential":
+            return self._random.expovariate(1 / mean) if mean > 0 else 0
+
+        # lognormal with the given mean, sigma is the spread of the log
+        sigma = self.latency.get("sigma", 0.5)
+        return mean * self._random.lognormvariate(-sigma ** 2 / 2, sigma)
+
+    def _make_sample(self, seq, produced):
+        seq_key, produced_key, *value_keys = self.schema.keys
+
+        sample = {seq_key: seq, produced_key: produced}
+        for key in value_keys:
+            sample[key] = self._random.random()
+        return sample
+
+    def _read(self):
+        time.sleep(self._read_latency())
+
+        if self._random.random() < self.failure_rate:
+            raise Exception("Synthetic failure")
+
+    def read_samples(self):
+        self._read()
+
+        # everything produced since the last read, stamped when it was
+        produced = int((time.time() - self._start_time) * self.rate)
+        samples = []
+        for seq in range(self._produced, produced):
+            timestamp = self._start_time + seq / self.rate
+            samples.append((timestamp, self._make_sample(seq, timestamp)))
+        self._produced = produced
+
+        return samples
+
+    def read_data(self):
+        self._read()
+
+        # the latest sample produced
+        seq = max(int((time.time() - self._start_time) * self.rate) - 1, 0)
+        self._produced = seq + 1
+
+        return self._make_sample(seq, self._start_time + seq / self.rate)
+
+    @staticmethod
+    def speak_data(data):
+        if data is None or not isinstance(data, dict):
+            return
+        return "Synthetic sample"
@@ -0,0 +1,95 @@
+"""
+Running a SensingService as a thread in the client process rather than as
+its own process. Saves an interpreter per sensor and the pickling of every
+message, at the cost of isolation: a driver which hangs can't be killed,
+and one which crashes the interpreter takes the client with it.
+"""
+from collections import deque
+import os
+import select
+import threading
+
+from ..utils.status_utils import STATUS_MESSAGES
+
+# how long stopping waits for a service thread to finish
+THREAD_JOIN_TIMEOUT = 1
+
+
+class LocalConnection:
+    """
+    One end of an in-process, one way pipe. Messages are handed over as
+    they are, without pickling. An os pipe carries one byte per message,
+    so the connection has a file descriptor which is readable whenever a
+    message is waiting, for the event loop and connection.wait.
+    """
+
+    def __init__(self, messages, fd, writable):
+        self._messages = messages
+        self._fd = fd
+        self._writable = writable
+
+    def fileno(self):
+        return self._fd
+
+    def send(self, obj):
+        if not self._writable:
+            raise OSError("connection is read only")
+
+        self._messages.append(obj)
+        os.write(self._fd, b"\0")
+
+    def poll(self, timeout=0.0):
+        # readable also once the other end is closed, so recv can raise EOFError
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        return bool(readable)
+
+    def recv(self):
+        # a message is always queued before its byte is written
+        if os.read(self._fd, 1) == b"":
+            raise EOFError
+
+        return self._messages.popleft()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def LocalPipe():
+    """As multiprocessing.Pipe(duplex=False), returns (receive end, send end)."""
+    read_fd, write_fd = os.pipe()
+    messages = deque()
+
+    return LocalConnection(messages, read_fd, False), LocalConnection(messages, write_fd, True)
+
+
+class ServiceThread(threading.Thread):
+    """
+    Runs a service's main loop on a thread, standing in for its process
+    in the SensingServiceHandle.
+    """
+
+    def __init__(self, service, stop_pipe):
+        super().__init__(name=service.__id__, daemon=True)
+
+        self.service = service
+        self._stop_pipe = stop_pipe
+
+    def run(self):
+        try:
+            self.service.run()
+        finally:
+            self.service._send_pipe_to_main.close()
+            self.service._recv_pipe_from_main.close()
+
+    def terminate(self):
+        """Ask the service loop to stop, there's no killing a thread."""
+        try:
+            self._stop_pipe.send((STATUS_MESSAGES.STOP.value, None, None))
+        except (OSError, TypeError):
+            # already closed
+            pass
+
+    def join(self, timeout=THREAD_JOIN_TIMEOUT):
+        super().join(timeout)
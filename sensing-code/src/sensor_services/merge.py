@@ -0,0 +1,57 @@
+import math
+
+from .schema import Field, Schema
+
+
+class MERGE_MODE:
+    # take each service's latest sample at or before the tick, and record
+    # how old it was in a <service_id>_age_s column
+    CARRY_FORWARD = "carry_forward"
+    # linearly interpolate float fields between the samples either side of
+    # the tick, other fields are carried forward
+    INTERPOLATE = "interpolate"
+
+
+def age_key(service_id):
+    return "{}_age_s".format(service_id)
+
+
+def merge_schema(service_ids, merge_mode):
+    """The extra columns a merge mode adds to the output rows."""
+    if merge_mode != MERGE_MODE.CARRY_FORWARD:
+        return Schema([])
+
+    return Schema([Field(age_key(service_id), "f8", unit="s") for service_id in service_ids])
+
+
+def interpolate(before, after, timestamp, schema):
+    """
+    Value of each field at timestamp, between the (timestamp, data)
+    samples before and after it. Only float fields are interpolated, the
+    rest keep the value from before.
+    """
+    t0, data0 = before
+    t1, data1 = after
+
+    data = dict(data0)
+
+    if t1 <= t0:
+        return data
+
+    weight = (timestamp - t0) / (t1 - t0)
+
+    for field in schema.fields:
+        if field.dtype.lstrip("<>=|")[0] != "f":
+            continue
+
+        for key in field.keys:
+            v0 = data0.get(key)
+            v1 = data1.get(key)
+
+            if not isinstance(v0, (int, float)) or not isinstance(v1, (int, float)) \
+                    or math.isnan(v0) or math.isnan(v1):
+                continue
+
+            data[key] = v0 + (v1 - v0) * weight
+
+    return data
@@ -0,0 +1,94 @@
+import asyncio
+from collections import deque
+
+
+class OVERRUN_POLICY:
+    # drop the ticks that were missed and carry on from the next deadline
+    SKIP = "skip"
+    # run the missed ticks back to back until the schedule is caught up
+    CATCH_UP = "catch_up"
+    # restart the schedule from the late tick, shifting every later tick
+    STRETCH = "stretch"
+
+
+class TickScheduler:
+    """
+    Paces a loop at a fixed rate against absolute deadlines on the event
+    loop's monotonic clock. Deadlines are start + n * period, so time spent
+    in the loop body doesn't make the rate drift. When the body overruns a
+    whole period, overrun_policy decides what happens to the missed ticks.
+
+    Per tick jitter (how late the tick actually fired) and overrun counts
+    are kept for stats().
+    """
+
+    def __init__(self, rate, overrun_policy=OVERRUN_POLICY.SKIP, jitter_window=1000):
+
+        if overrun_policy not in (OVERRUN_POLICY.SKIP, OVERRUN_POLICY.CATCH_UP, OVERRUN_POLICY.STRETCH):
+            raise ValueError("Unknown overrun policy {}".format(overrun_policy))
+
+        self.period = 1 / rate
+        self.overrun_policy = overrun_policy
+
+        self.next_deadline = None
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+        self.max_jitter = 0
+        self._jitter_total = 0
+        self._recent_jitter = deque(maxlen=jitter_window)
+
+    async def wait(self):
+        """
+        Sleep until the next tick is due. Returns the tick's deadline,
+        in loop.time().
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        if self.next_deadline is None:
+            self.next_deadline = now
+
+        if now >= self.next_deadline + self.period:
+            # missed at least one whole tick
+            self.overruns += 1
+
+            if self.overrun_policy == OVERRUN_POLICY.SKIP:
+                missed = int((now - self.next_deadline) // self.period)
+                self.skipped_ticks += missed
+                self.next_deadline += missed * self.period
+
+            elif self.overrun_policy == OVERRUN_POLICY.STRETCH:
+                self.next_deadline = now
+
+        delay = self.next_deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        deadline = self.next_deadline
+        self.next_deadline += self.period
+
+        self._record_jitter(loop.time() - deadline)
+
+        return deadline
+
+    def _record_jitter(self, jitter):
+        self.ticks += 1
+        self._jitter_total += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self._recent_jitter.append(jitter)
+
+    def stats(self):
+        recent = sorted(self._recent_jitter)
+
+        return {
+            "rate": 1 / self.period,
+            "overrun_policy": self.overrun_policy,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped_ticks": self.skipped_ticks,
+            "mean_jitter_ms": 1000 * self._jitter_total / self.ticks if self.ticks else 0,
+            "p99_jitter_ms": 1000 * recent[int(0.99 * (len(recent) - 1))] if recent else 0,
+            "max_jitter_ms": 1000 * self.max_jitter,
+        }
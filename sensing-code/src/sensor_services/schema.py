@@ -0,0 +1,135 @@
+
+# value used where a field is missing or can't be parsed, by numpy dtype kind
+FILL_VALUES = {
+    "f": float("nan"),
+    "i": -1,
+    "u": 0,
+    "b": False,
+    "U": "",
+    "S": b"",
+}
+
+
+def fill_value(dtype):
+    return FILL_VALUES[dtype.lstrip("<>=|")[0]]
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        # e.g. "12.0"
+        return int(float(value))
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "t", "yes")
+    return bool(value)
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+CONVERTERS = {
+    "f": float,
+    "i": _to_int,
+    "u": _to_int,
+    "b": _to_bool,
+    "U": str,
+    "S": _to_bytes,
+}
+
+
+class Field:
+    """
+    A typed field in a service's sample schema.
+
+    :param name: The key the value is stored under.
+    :param dtype: NumPy style dtype string, e.g. "f8", "i4", "U16".
+    :param unit: Unit of the value, for reference only.
+    :param width: Number of columns. Fields wider than 1 expand into keys
+                  name0 ... name{width - 1}, like the POPS histogram bins.
+    :param count: For wide fields, the name of another field holding how
+                  many of the columns are actually in use (e.g. "nbins").
+                  Columns past that are filled rather than parsed.
+    """
+
+    def __init__(self, name, dtype="f8", unit=None, width=1, count=None):
+        self.name = name
+        self.dtype = dtype
+        self.unit = unit
+        self.width = width
+        self.count = count
+
+        self.kind = dtype.lstrip("<>=|")[0]
+        self.fill = fill_value(dtype)
+        self.convert = CONVERTERS[self.kind]
+
+    @property
+    def keys(self):
+        if self.width == 1:
+            return [self.name]
+        return ["{}{}".format(self.name, i) for i in range(self.width)]
+
+    def __repr__(self):
+        return "Field(name={}, dtype={}, unit={}, width={}, count={})".format(
+            self.name, self.dtype, self.unit, self.width, self.count)
+
+
+class Schema:
+    """
+    The fixed, typed layout of the samples a service produces.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+
+        self.keys = []
+        for field in self.fields:
+            self.keys += field.keys
+
+        if len(set(self.keys)) != len(self.keys):
+            raise ValueError("Schema has duplicate keys")
+
+    def __add__(self, other):
+        return Schema(self.fields + other.fields)
+
+    def numpy_fields(self):
+        """(key, dtype) pairs, one per column, for building a NumPy dtype."""
+        return [(key, field.dtype) for field in self.fields for key in field.keys]
+
+    def numpy_dtype(self):
+        import numpy as np
+        return np.dtype(self.numpy_fields())
+
+    def coerce(self, data):
+        """
+        Convert a sample dict to native typed values. Keys outside the
+        schema are dropped, values which can't be parsed are filled and
+        keys which are missing stay missing.
+        """
+        out = {}
+
+        for field in self.fields:
+            in_use = field.width
+            if field.count is not None and out.get(field.count) is not None:
+                in_use = min(max(out[field.count], 0), field.width)
+
+            for i, key in enumerate(field.keys):
+                if key not in data:
+                    continue
+
+                if i >= in_use:
+                    out[key] = field.fill
+                    continue
+
+                try:
+                    out[key] = field.convert(data[key])
+                except (ValueError, TypeError):
+                    out[key] = field.fill
+
+        return out
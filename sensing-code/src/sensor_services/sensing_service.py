@@ -1,11 +1,18 @@
 
 from multiprocessing import Process
+from multiprocessing.connection import wait
 from abc import ABCMeta, abstractmethod
 import logging
+import signal
+import threading
 import time
 
-from ..utils.logging_utils import get_cur_logger_dir
+from ..utils.logging_utils import configure_logger, flush_logger, get_cur_logger_dir, sampled
 from ..utils.status_utils import STATUS_MESSAGES
+from .schema import Field, Schema
+
+# extra= for the per sample traces, see DebugRateLimit
+SAMPLED = sampled()
 
 
 class SensingService(Process, metaclass=ABCMeta):
@@ -14,21 +21,72 @@ class SensingService(Process, metaclass=ABCMeta):
 
     _config = None
 
+    # upper bound on how often read_data is called, overridable with
+    # the "max_sample_rate" config value
+    max_sample_rate = 100
+
+    _last_sample_time = 0
+
+    # how often main samples this service, overridable with the
+    # "sample_rate" config value. None follows the client's rate.
+    sample_rate = None
+
+    # how streamed samples get to main, "pipe" or "shm" (a shared memory
+    # ring buffer), overridable with the "stream_transport" config value
+    stream_transport = "pipe"
+
+    _ring_buffer = None
+
+    # the typed layout of the samples read_data returns, see schema.py
+    schema = None
+
+    # run in a process of its own rather than a thread in the client, for
+    # drivers which can hang or crash. Overridable with the "isolated"
+    # config value, see in_process.py
+    isolated = False
+
+    # convert what read_data returns to the schema's types. Services which
+    # already return typed values can skip it
+    coerce_samples = True
+
+    # modules startup() imports, which are slow to import (e.g. hardware
+    # drivers). The client imports them once up front, see preload.py
+    preload_modules = ()
+
+    # while read_data answers a request from main, when main gives up on
+    # it (time.time()), so a read which waits for the sensor can return in
+    # time. None otherwise, e.g. when streaming
+    request_deadline = None
+
     def __init__(self, config, _send_pipe_to_main, _recv_pipe_from_main):
         super(SensingService, self).__init__(daemon=True)
         self._config = config
         self._send_pipe_to_main = _send_pipe_to_main
         self._recv_pipe_from_main = _recv_pipe_from_main
+
+        if isinstance(config, dict) and config.get("max_sample_rate") is not None:
+            self.max_sample_rate = config["max_sample_rate"]
         # self.start()
 
     def run(self):
 
+        # forked from main, so we inherit its signal handlers. Shutdown is
+        # driven by main, so let terminate() work and ignore ctrl+c. Only
+        # applies to a process, a service thread shares main's handlers.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+
         logger = self.get_logger()
 
         if self._send_pipe_to_main is None or self._recv_pipe_from_main is None:
             logger.critical("Pipes to main thread are not set")
             return
 
+        # set by STOP, which is answered once torn down
+        stop_seq = None
+        stopped = False
+
         try:
             # Startup Sequence
             startup_error = None
@@ -37,75 +95,216 @@ class SensingService(Process, metaclass=ABCMeta):
                 self.startup()
             except Exception as e:
                 startup_error = e
-                logger.error("Startup Error: {}".format(e))
+                logger.error("Startup Error: %s", e)
             # End startup sequence
 
             logger.info("Startup sequence finished")
 
+            # streaming state, set once main sends START_STREAM
+            stream_period = None
+            batch_interval = None
+            next_sample_time = None
+            last_batch_time = None
+            batch = []
+
+            # sensor file descriptors which, when streaming, trigger a
+            # sample as soon as they're readable instead of on a timer
+            sensor_handles = self.get_wait_handles() if startup_error is None else []
+
             while True:
 
-                # wait for poll
-                if self._recv_pipe_from_main.poll():
+                now = time.time()
+                wait_handles = [self._recv_pipe_from_main]
+                deadlines = []
+
+                if stream_period is not None:
+                    if batch:
+                        deadlines.append(last_batch_time + batch_interval)
+
+                    if not sensor_handles:
+                        deadlines.append(next_sample_time)
+                    elif now < self._last_sample_time + self._min_sample_interval:
+                        # rate limited, check the sensor again once allowed
+                        deadlines.append(
+                            self._last_sample_time + self._min_sample_interval)
+                    else:
+                        wait_handles += sensor_handles
+
+                # block until main or the sensor needs us, or a deadline passes
+                timeout = max(0, min(deadlines) - now) if deadlines else None
+                ready = wait(wait_handles, timeout)
+
+                if self._recv_pipe_from_main in ready:
 
                     challenge = self._recv_pipe_from_main.recv()
 
-                    logger.debug("Received challenge: {}".format(challenge))
+                    logger.debug("Received challenge: %s", challenge, extra=SAMPLED)
 
                     if not isinstance(challenge, tuple):
                         logger.error("Challenge is not a tuple")
-                        continue
 
-                    if not(1 <= len(challenge) <= 2):
+                    elif len(challenge) != 3:
                         logger.error("Challenge has wrong length")
-                        continue
 
-                    challenge_type = challenge[0]
-                    # challenge_data = challenge[1] not needed but included for completeness
+                    elif challenge[0] == STATUS_MESSAGES.HEARTBEAT_SYN.value:
 
-                    if challenge_type == STATUS_MESSAGES.HEARTBEAT_SYN.value:
+                        # replies carry the request's sequence number
+                        seq = challenge[1]
 
                         if startup_error is not None:
                             self._send_pipe_to_main.send(
-                                (STATUS_MESSAGES.STARTUP_ERROR.value, startup_error))
+                                (STATUS_MESSAGES.STARTUP_ERROR.value, seq, startup_error))
                             logger.debug("Sent startup error")
                         else:
                             self._send_pipe_to_main.send(
-                                (STATUS_MESSAGES.HEARTBEAT_ACK.value,))
+                                (STATUS_MESSAGES.HEARTBEAT_ACK.value, seq, None))
                             logger.debug("Sent heartbeat ack")
 
-                    elif challenge_type == STATUS_MESSAGES.GET_DATA.value:
+                    elif challenge[0] == STATUS_MESSAGES.GET_DATA.value:
 
-                        try:
-                            data = self.read_data()
-                        except Exception as e:
-                            self._send_pipe_to_main.send(
-                                (STATUS_MESSAGES.DATA_ERROR.value, e))
-                            logger.debug("Sent data error {}".format(e))
+                        seq, request = challenge[1], challenge[2]
 
-                            time.sleep(.01)
-                            continue
-
-                        if data is None:
-                            self._send_pipe_to_main.send(
-                                (STATUS_MESSAGES.DATA_ERROR.value, "No data returned"))
-                            logger.debug("Sent data error")
+                        # main has given up on it, don't spend a read on it
+                        if request is not None and time.time() > request["deadline"]:
+                            logger.debug(
+                                "Skipped expired data request %s", seq, extra=SAMPLED)
                         else:
-                            self._send_pipe_to_main.send(
-                                (STATUS_MESSAGES.DATA_OK.value, data))
-                            logger.debug("Sent data ok")
-
-                    elif challenge_type == STATUS_MESSAGES.STOP.value:
+                            self.request_deadline = None if request is None else request["deadline"]
+                            try:
+                                status, payload = self._sample()
+                            finally:
+                                self.request_deadline = None
+                            self._send_pipe_to_main.send((status, seq, payload))
+                            logger.debug("Sent data response", extra=SAMPLED)
+
+                    elif challenge[0] == STATUS_MESSAGES.START_STREAM.value:
+
+                        stream_settings = challenge[2]
+                        stream_period = 1 / min(
+                            stream_settings["sample_rate"], self.max_sample_rate)
+                        batch_interval = stream_settings["batch_interval"]
+
+                        if stream_settings.get("ring_buffer") is not None:
+                            from ..utils.ring_buffer import SampleRingBuffer
+
+                            if self._ring_buffer is not None:
+                                self._ring_buffer.close()
+                            self._ring_buffer = SampleRingBuffer.attach(
+                                **stream_settings["ring_buffer"])
+                        next_sample_time = time.time()
+                        last_batch_time = time.time()
+                        logger.info("Started streaming at %s Hz", 1 / stream_period)
+
+                    elif challenge[0] == STATUS_MESSAGES.STOP.value:
                         logger.debug("Received stop")
+                        stop_seq = challenge[1]
+                        stopped = True
                         break
 
-                # max sampling rate = 100Hz
-                time.sleep(.01)
+                if stream_period is not None:
+                    now = time.time()
+
+                    if sensor_handles:
+                        sample_due = any(
+                            handle in ready for handle in sensor_handles)
+                    else:
+                        sample_due = now >= next_sample_time
+
+                    if sample_due:
+                        # everything the sensor has queued, not just the latest
+                        for timestamp, status, payload in self._sample_all():
+
+                            # good samples skip the pipe when there's a ring buffer
+                            if self._ring_buffer is not None and status == STATUS_MESSAGES.DATA_OK.value:
+                                self._ring_buffer.write(timestamp, payload)
+                            else:
+                                batch.append((timestamp, status, payload))
+
+                        # schedule from the previous deadline so the rate
+                        # doesn't drift, but never try to catch up a backlog
+                        next_sample_time = max(
+                            next_sample_time + stream_period, now)
+
+                    if batch and now - last_batch_time >= batch_interval:
+                        self._send_pipe_to_main.send(
+                            (STATUS_MESSAGES.STREAM_DATA.value, None, batch))
+                        logger.debug(
+                            "Sent stream batch of %s samples", len(batch), extra=SAMPLED)
+                        batch = []
+                        last_batch_time = now
         except Exception as e:
-            logger.error("Error in main loop: {}".format(e))
+            logger.error("Error in main loop: %s", e)
         finally:
+            if self._ring_buffer is not None:
+                self._ring_buffer.close()
+                self._ring_buffer = None
+
             self.teardown()
             logger.info("Teardown sequence finished")
 
+            # a process exits without the atexit hooks which would write
+            # the logs still queued
+            flush_logger(logger)
+
+            if stopped:
+                try:
+                    self._send_pipe_to_main.send(
+                        (STATUS_MESSAGES.STOP_ACK.value, stop_seq, None))
+                except (OSError, ValueError):
+                    # main has stopped listening
+                    pass
+
+    @property
+    def _min_sample_interval(self):
+        return 1 / self.max_sample_rate
+
+    def _wait_for_rate_limit(self):
+        """Space reads at least 1/max_sample_rate apart."""
+        rate_limit_wait = self._last_sample_time + \
+            self._min_sample_interval - time.time()
+        if rate_limit_wait > 0:
+            time.sleep(rate_limit_wait)
+
+        self._last_sample_time = time.time()
+
+    def _sample(self):
+        """
+        Read the sensor once, returning the (status, payload) pair
+        sent back to main.
+        """
+        self._wait_for_rate_limit()
+
+        try:
+            data = self.read_data()
+        except Exception as e:
+            return (STATUS_MESSAGES.DATA_ERROR.value, e)
+
+        return self._check_sample(data)
+
+    def _sample_all(self):
+        """
+        Read every sample the sensor has ready, as the (timestamp, status,
+        payload) triples streamed to main.
+        """
+        self._wait_for_rate_limit()
+
+        try:
+            samples = self.read_samples()
+        except Exception as e:
+            return [(time.time(), STATUS_MESSAGES.DATA_ERROR.value, e)]
+
+        return [(timestamp,) + self._check_sample(data) for timestamp, data in samples]
+
+    def _check_sample(self, data):
+        if data is None:
+            return (STATUS_MESSAGES.DATA_ERROR.value, "No data returned")
+
+        # convert to native types once, here, so nothing downstream parses
+        if isinstance(data, dict) and self.coerce_samples:
+            data = self.get_schema().coerce(data)
+
+        return (STATUS_MESSAGES.DATA_OK.value, data)
+
     def get_logger(self):
 
         if self._logger is not None:
@@ -120,8 +319,6 @@ class SensingService(Process, metaclass=ABCMeta):
 
         logfile = "{}/{}.log".format(logfile_dir, type(self).__name__)
 
-        self._logger.setLevel(logging.DEBUG)
-
         filehandler = logging.FileHandler(
             logfile
         )
@@ -133,17 +330,59 @@ class SensingService(Process, metaclass=ABCMeta):
 
         filehandler.setFormatter(formatter)
 
-        self._logger.addHandler(filehandler)
+        # written from a thread of its own, see BackgroundLogHandler
+        configure_logger(self._logger, filehandler)
 
         return self._logger
 
     def __del__(self):
 
+        # no teardown(): run() always does that where the service ran. Here
+        # it may be main's copy of a service which ran in another process
         if self._recv_pipe_from_main is not None:
             self._recv_pipe_from_main.close()
         if self._send_pipe_to_main is not None:
             self._send_pipe_to_main.close()
-        self.teardown()
+
+    def read_samples(self):
+        """
+        Every sample ready to be read, as a list of (timestamp, data) in
+        the order they were taken. Used when streaming, so sensors which
+        queue up readings (e.g. datagrams on a socket) can hand over all
+        of them rather than only the latest. Defaults to one read_data.
+        """
+        data = self.read_data()
+
+        # stamped once read, a slow sensor's reading is that fresh
+        return [(time.time(), data)]
+
+    def get_wait_handles(self):
+        """
+        Objects with a fileno() (e.g. sockets) which become readable when
+        the sensor has new data. When streaming, these are waited on
+        alongside the pipe from main and a sample is taken as soon as one
+        is readable, rather than on a timer.
+        """
+        return []
+
+    @classmethod
+    def get_schema(cls):
+        """
+        The service's sample schema. Services which only define get_keys()
+        get an untyped schema of float columns.
+        """
+        if cls.schema is not None:
+            return cls.schema
+
+        return Schema([Field(key) for key in cls.get_keys()])
+
+    @classmethod
+    def get_keys(cls):
+        if cls.schema is None:
+            raise NotImplementedError(
+                "{} declares neither a schema nor get_keys()".format(cls.__name__))
+
+        return cls.schema.keys
 
     @abstractmethod
     def configure(self, config):
@@ -1,26 +1,40 @@
 
 import asyncio
-from multiprocessing import Pipe
 from typing import Dict, List
 
+from .preload import preload_service_modules
+from .merge import MERGE_MODE, age_key, interpolate, merge_schema
+from .scheduler import OVERRUN_POLICY, TickScheduler
+from .schema import Schema
 from .service_delegate import ServiceDelegate
+from .service_stats import HEALTH_STATUS
 
 
 import logging
 
-from ..utils.logging_utils import get_cur_logger_dir
+from ..utils.logging_utils import configure_logger, get_cur_logger_dir
 import time
 
+# seconds between the supervisor's checks on the services
+SUPERVISE_INTERVAL = 1
+
 
 class SensingServiceManager:
 
     registered_services: Dict[str, ServiceDelegate] = {}
 
+    startup_report = None
+
+    scheduler = None
+
     _logger = None
 
     def __init__(self, services):
         self._register_services(services)
 
+        # the restart in flight for each service, at most one
+        self._restarts = {}
+
     def _register_services(self, services):
         """
         Takes list of services and adds them to the list.
@@ -65,9 +79,67 @@ class SensingServiceManager:
         service_status.config = config
 
     async def start(self):
-
-        for service_id in self.registered_services.keys():
-            await self.start_service(service_id)
+        """
+        Start every service concurrently. Returns as soon as the first one
+        is up and healthy (or all have failed), the rest join sampling as
+        they come online. Once every service has finished starting, a
+        startup report is logged.
+
+        Meanwhile the driver modules of services run in a process of their
+        own are preloaded in an executor, and those services are started
+        once it's done (see preload.py). Thread services import in the
+        client anyway, so they start straight away.
+        """
+        preload = asyncio.get_running_loop().run_in_executor(
+            None, preload_service_modules,
+            [delegate.service_class for delegate in self.registered_services.values() if delegate.isolated],
+            self.get_logger())
+
+        start_tasks = {
+            asyncio.ensure_future(self._start_preloaded(service_id, preload)): service_id
+            for service_id in self.registered_services.keys()
+        }
+
+        # keep a reference, so the report isn't garbage collected mid-way
+        self._startup_report_task = asyncio.ensure_future(
+            self._report_startup(start_tasks))
+
+        pending = set(start_tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+
+            if any(self.registered_services[start_tasks[task]].is_running for task in done):
+                return
+
+    async def _start_preloaded(self, service_id, preload):
+        if self.registered_services[service_id].isolated:
+            # forked with the modules loaded, and not in the middle of an import
+            await preload
+
+        return await self.start_service(service_id)
+
+    async def _report_startup(self, start_tasks):
+        await asyncio.gather(*start_tasks, return_exceptions=True)
+
+        self.startup_report = {}
+        for service_id, delegate in self.registered_services.items():
+            self.startup_report[service_id] = {
+                "running": delegate.is_running,
+                "time_to_heartbeat": delegate.startup_time,
+                "error": None if delegate.is_running else str(delegate.last_error)
+            }
+
+        lines = []
+        for service_id, report in self.startup_report.items():
+            if report["running"]:
+                lines.append("{}: up in {:.3f} s".format(
+                    service_id, report["time_to_heartbeat"]))
+            else:
+                lines.append("{}: failed ({})".format(
+                    service_id, report["error"]))
+
+        self.get_logger().info("Startup report: %s", "; ".join(lines))
 
     def get_service_status(self, service_id) -> ServiceDelegate:
         if service_id not in self.registered_services:
@@ -83,20 +155,53 @@ class SensingServiceManager:
     async def start_service(self, service_id):
         return await self.registered_services[service_id].start(is_manual=True)
 
-    async def get_all_data(self, data_timeout):
-        # logger = self.get_logger()
+    def get_output_schema(self, merge_mode=MERGE_MODE.CARRY_FORWARD):
+        """Schema of the rows monitor_services yields, without time_ms."""
+        schema = Schema([])
+        for delegate in self.registered_services.values():
+            schema += delegate.service_class.get_schema()
+
+        return schema + merge_schema(self.registered_services.keys(), merge_mode)
+
+    def get_merged_data(self, tick_time, merge_mode=MERGE_MODE.CARRY_FORWARD):
+        """
+        Merge every active service's recent samples into one row at
+        tick_time. Services are sampled at their own rates, so each one is
+        either carried forward from its latest sample at or before the
+        tick, or interpolated between the samples either side of it.
+        Samples older than a couple of that service's periods are
+        considered stale and left out.
+        """
         data_obj = {}
 
-        coros = []
         for service_id in self.get_active_services():
-            coros.append(self.registered_services[service_id].get_data(
-                data_timeout=data_timeout))
+            delegate = self.registered_services[service_id]
+
+            if delegate.is_streaming:
+                delegate.collect_stream()
+
+            stale_after = delegate.stale_after
+            if stale_after is None:
+                continue
+
+            before, after = delegate.samples_around(tick_time)
+            if before is None or tick_time - before[0] > stale_after:
+                continue
 
-        gathered = await asyncio.gather(*coros)
+            timestamp, data = before
+            if not isinstance(data, dict):
+                continue
 
-        for data in gathered:
-            if data is not None and isinstance(data, dict):
-                data_obj.update(data)
+            if merge_mode == MERGE_MODE.INTERPOLATE:
+                if after is not None:
+                    data = interpolate(before, after, tick_time,
+                                       delegate.service_class.get_schema())
+            else:
+                data_obj[age_key(service_id)] = tick_time - timestamp
+
+            data_obj.update(data)
+
+        data_obj["time_ms"] = tick_time
 
         return data_obj
 
@@ -108,11 +213,22 @@ class SensingServiceManager:
 
         if not service_status.is_running:
             logger.info(
-                "Tried to terminate service {} but service not started.".format(service_id))
+                "Tried to terminate service %s but service not started.", service_id)
             return False
 
         service_status.terminate_handle()
 
+    async def stop_services(self):
+        """
+        Stop every service, letting each tear down gracefully, and wait
+        for their workers to be closed.
+        """
+        for task in self._restarts.values():
+            task.cancel()
+
+        await asyncio.gather(*[delegate.shutdown() for delegate in self.registered_services.values()],
+                             return_exceptions=True)
+
     def get_logger(self):
 
         if self._logger is not None:
@@ -127,8 +243,6 @@ class SensingServiceManager:
 
         logfile = logfile_dir + "/service_manager.log"
 
-        self._logger.setLevel(logging.DEBUG)
-
         filehandler = logging.FileHandler(
             logfile
         )
@@ -144,58 +258,111 @@ class SensingServiceManager:
         ch.setLevel(logging.INFO)
         ch.setFormatter(formatter)
 
-        self._logger.addHandler(filehandler)
-        self._logger.addHandler(ch)
+        # written from a thread of its own, see BackgroundLogHandler
+        configure_logger(self._logger, filehandler, ch)
 
         return self._logger
 
-    async def tlc_services(self):
+    async def supervise(self, interval=SUPERVISE_INTERVAL):
+        """
+        Look after the services every interval seconds until cancelled, see
+        tlc_services. One long lived task, rather than one per tick.
+        """
+        try:
+            while True:
+                self.tlc_services()
+                await asyncio.sleep(interval)
+        finally:
+            for task in self._restarts.values():
+                task.cancel()
+
+    def tlc_services(self):
         """ Provice TLC to services
 
             This means:
             - Restarting services which refuse to start up to 5 times at exponential backoff
             - Restarting services which are unhealthy (not responding to heartbeat)
 
+            Restarts run as tasks of their own, at most one per service at
+            a time, so a slow one doesn't hold up sampling or the others.
         """
 
         for service_id, service_status in self.registered_services.items():
-            if service_status.should_reboot and not service_status.is_healthy and not service_status.is_waiting_to_reboot:
-                service_status.stop()
-                await service_status.try_reboot()
+            if service_id in self._restarts or not service_status.needs_restart:
+                continue
+
+            task = asyncio.ensure_future(service_status.restart())
+            self._restarts[service_id] = task
+            task.add_done_callback(
+                lambda _, service_id=service_id: self._restarts.pop(service_id, None))
+
+    def get_service_stats(self):
+        """Each service's rolling stats (see ServiceStats.snapshot), by id."""
+        return {service_id: dict(delegate.stats.snapshot(), last_teardown=delegate.last_teardown)
+                for service_id, delegate in self.registered_services.items()}
 
     def get_healthy_services(self) -> List[ServiceDelegate]:
 
         services: List[ServiceDelegate] = []
         for service, delegate in self.registered_services.items():
-            if self.registered_services[service].is_healthy:
+            # is_healthy only rules out dead services (for restarting), a
+            # mostly failing one isn't healthy either
+            if delegate.is_running and delegate.health == HEALTH_STATUS.OK:
                 services.append(delegate)
         return services
 
-    async def monitor_services(self, sample_rate):
+    async def monitor_services(self, sample_rate, streaming=False, overrun_policy=OVERRUN_POLICY.SKIP, merge_mode=MERGE_MODE.CARRY_FORWARD):
         """
-        Monitor services, yielding data at the given sample rate.
-
-        Additionally perform tlc on services (including restarting iff sick.)
+        Monitor services, yielding merged rows at the given sample rate.
+
+        Every service is sampled at its own rate (falling back to
+        sample_rate), either by polling it from its own task or, in
+        streaming mode, by having it push a batch of readings once per
+        tick. Each tick the latest samples are merged into one row (see
+        get_merged_data), so fast sensors keep their resolution and slow
+        ones aren't asked for data they don't have yet.
+
+        Ticks are paced against absolute deadlines (see TickScheduler), so
+        the rate doesn't drift with the time spent handling each reading.
+        If handling a reading overruns whole ticks, overrun_policy decides
+        whether they're skipped, caught up or the schedule is shifted.
+
+        Rows lag real time a little, so the samples they're built from
+        have arrived: by one tick when streaming, and when interpolating
+        by long enough for the slowest service's next sample.
+
+        Meanwhile the services are supervised (restarted if sick), see
+        supervise.
         """
         sampling_timeout = 1/sample_rate
 
-        last_reading_time = time.time()
-
-        loop = asyncio.get_event_loop()
-        while True:
+        lag = sampling_timeout if streaming else 0
 
-            d = await self.get_all_data(data_timeout=sampling_timeout)
+        poll_tasks = []
+        for delegate in self.registered_services.values():
+            service_rate = delegate.sample_rate or sample_rate
 
-            yield d
+            if streaming:
+                delegate.enable_streaming(
+                    service_rate, batch_interval=sampling_timeout)
+            else:
+                poll_tasks.append(asyncio.ensure_future(
+                    delegate.poll(service_rate, overrun_policy)))
 
-            loop.create_task(self.tlc_services())
+            if merge_mode == MERGE_MODE.INTERPOLATE:
+                lag = max(lag, 2 / service_rate +
+                          (sampling_timeout if streaming else 0))
 
-            # sleep the required time to keep the same sample rate
-            loop_time = time.time() - last_reading_time
+        self.scheduler = TickScheduler(sample_rate, overrun_policy)
 
-            await asyncio.sleep(max(sampling_timeout - loop_time, sampling_timeout))
+        supervisor = asyncio.ensure_future(self.supervise())
+        try:
+            while True:
 
-            self.get_logger().debug("Sampling rate: {}".format(
-                1/(time.time() - last_reading_time) if time.time() - last_reading_time > 0 else 0))
+                await self.scheduler.wait()
 
-            last_reading_time = time.time()
+                yield self.get_merged_data(time.time() - lag, merge_mode)
+        finally:
+            supervisor.cancel()
+            for task in poll_tasks:
+                task.cancel()
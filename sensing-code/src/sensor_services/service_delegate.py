@@ -1,23 +1,37 @@
 
 import asyncio
+import itertools
+import time
 from multiprocessing import Pipe
-from src.sensor_services.helpers import SERVICE_STATUS, SensingServiceHandle, ServiceError
+from src.sensor_services.helpers import SERVICE_STATUS, STOP_TIMEOUT, SensingServiceHandle, ServiceError
+from src.sensor_services.in_process import LocalPipe, ServiceThread
+from src.sensor_services.scheduler import OVERRUN_POLICY, TickScheduler
 from src.sensor_services.sensing_service import SensingService
+from src.sensor_services.service_stats import HEALTH_STATUS, ServiceStats
 
 from datetime import datetime, timedelta
 from collections import deque
 
+from src.utils.logging_utils import sampled
 from src.utils.status_utils import STATUS_MESSAGES
 
 HEARTBEAT_TIMEOUT = 1
 
 REBOOT_LOOKUP_TIMEOUTS = [1, 10, 20, 50, 150]  # in seconds
 
+# number of recent samples kept per service for merging
+STREAM_BUFFER_LENGTH = 256
 
-class HEALTH_STATUS:
-    OK = 0
-    UNHEALTHY_WITH_SUCCESS = 1
-    DEAD = 2
+# default number of records in a service's shared memory ring buffer
+RING_BUFFER_CAPACITY = 1024
+
+# default number of GET_DATA requests a polled service can have in flight,
+# overridable with the "max_outstanding_requests" config value
+MAX_OUTSTANDING_REQUESTS = 2
+
+# weight of the newest gap in the moving average of the gaps between a
+# sensor's samples arriving
+ARRIVAL_EWMA_ALPHA = 0.1
 
 
 class ServiceDelegate:
@@ -37,59 +51,317 @@ class ServiceDelegate:
         self.service_id = service_id
 
         self.logger = logger
+        # extra= for the per sample traces, rate limited by service
+        self._sampled = sampled(service_id)
         self.status = status
         self.errors = [] if errors is None else errors
         self.should_reboot = should_reboot
         self.last_reboot = last_reboot
         self.reboot_attempts = reboot_attempts
+        # every restart attempted, reboot_attempts is reset by a manual start
+        self.restarts = 0
         self.config = None
 
         self.active_handle = None
         self.last_error = None
 
-        self._metric_events = deque(maxlen=1000)
+        # seconds from the last start to its first heartbeat, None if it failed
+        self.startup_time = None
+
+        # rolling success rate, latency and errors, see service_stats.py
+        self.stats = ServiceStats()
+
+        self.stream_settings = None
+        # rate this service is being polled at, when it isn't streaming
+        self.poll_rate = None
+        # mean gap between samples arriving, and when the last one did
+        self.arrival_interval = None
+        self._last_arrival = None
+
+        # when the stream last brought data, and last counted as stalled
+        self._last_stream_data = None
+        self._last_no_data = None
+        # recent (timestamp, data) samples, whether streamed or polled
+        self.stream_buffer = deque(maxlen=STREAM_BUFFER_LENGTH)
+        self.ring_buffer = None
+
+        # requests waiting on a reply, by sequence number
+        self._pending = {}
+        self._seq = itertools.count()
+        # replies which arrived after their request had timed out
+        self.stale_replies = 0
+        # STREAM_DATA batches read off the pipe, for collect_stream
+        self._stream_messages = deque()
+
+        self._reader_loop = None
+        self._reader_fd = None
+
+        # the worker being closed, off the event loop, and how the last
+        # close went: {"steps": [(step, seconds, succeeded)], "seconds": ...}
+        self._teardown = None
+        self.last_teardown = None
 
     @property
     def is_running(self):
         return self.status == SERVICE_STATUS.RUNNING
 
+    @property
+    def is_starting(self):
+        return self.status == SERVICE_STATUS.STARTING
+
     @property
     def is_waiting_to_reboot(self):
         return self.status == SERVICE_STATUS.WAITING_TO_REBOOT
 
+    @property
+    def is_streaming(self):
+        return self.stream_settings is not None
+
+    @property
+    def sample_rate(self):
+        """
+        The rate this service wants to be sampled at, from its config
+        or else the service class. None means follow the manager.
+        """
+        if isinstance(self.config, dict) and self.config.get("sample_rate") is not None:
+            return self.config["sample_rate"]
+
+        return self.service_class.sample_rate
+
+    @property
+    def isolated(self):
+        """Whether the service runs in its own process, rather than a thread."""
+        if isinstance(self.config, dict) and self.config.get("isolated") is not None:
+            return self.config["isolated"]
+
+        return self.service_class.isolated
+
+    @property
+    def stale_after(self):
+        """
+        How old this service's latest sample can be before it's left out
+        of the merged output, or None if it isn't being sampled.
+        """
+        if self.stream_settings is not None:
+            period = 1 / self.stream_settings["sample_rate"]
+            lag = self.stream_settings["batch_interval"]
+        elif self.poll_rate is not None:
+            period = 1 / self.poll_rate
+            lag = 0
+        else:
+            return None
+
+        # a sensor which sends at its own pace is as fresh as it sends
+        if self.sends_at_own_pace and self.arrival_interval is not None:
+            period = max(period, self.arrival_interval)
+
+        return 2 * period + lag
+
+    @property
+    def sends_at_own_pace(self):
+        """Whether the sensor says when it has data, see get_wait_handles."""
+        return self.service_class.get_wait_handles is not SensingService.get_wait_handles
+
+    def _note_arrivals(self, timestamps):
+        """Keep the moving average of the gaps between samples arriving."""
+        for timestamp in timestamps:
+            if self._last_arrival is not None and timestamp > self._last_arrival:
+                gap = timestamp - self._last_arrival
+                self.arrival_interval = gap if self.arrival_interval is None else \
+                    self.arrival_interval + ARRIVAL_EWMA_ALPHA * (gap - self.arrival_interval)
+            self._last_arrival = timestamp
+
+    @property
+    def stream_transport(self):
+        if isinstance(self.config, dict) and self.config.get("stream_transport") is not None:
+            return self.config["stream_transport"]
+
+        return self.service_class.stream_transport
+
+    def release_handle(self):
+        """
+        Disconnect from the running worker without waiting for it, returning
+        its handle (or None) for the caller to close.
+        """
+        self._close_ring_buffer()
+        self._detach_reader(ServiceError(
+            "Service {} stopped".format(self.service_id), kind="stopped"))
+
+        handle, self.active_handle = self.active_handle, None
+        return handle
+
     def terminate_handle(self):
+        """
+        Close the worker. From the event loop that happens in the
+        background (see close_handle), elsewhere it blocks until done.
+        """
 
         # fail silently if the handle is not running
-        if self.active_handle is None:
+        handle = self.release_handle()
+        if handle is None:
             return
 
-        del self.active_handle
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._check_closed(handle.close(next(self._seq)))
+            return
 
-    @property
-    def is_healthy(self):
-        # Return
+        self._teardown = asyncio.ensure_future(self.close_handle(handle))
+
+    async def close_handle(self, handle):
+        """
+        Close a worker's handle in an executor, so however long the
+        STOP, terminate, kill escalation takes sampling carries on. Each
+        step is logged and the whole lot kept as last_teardown.
+        """
+        logger = self.logger
 
+        def on_step(step, seconds, succeeded):
+            logger.debug("Service %s %s %s after %.3f s",
+                         self.service_id, step, "succeeded" if succeeded else "failed", seconds)
+
+        start = time.time()
+        steps = await asyncio.get_running_loop().run_in_executor(
+            None, handle.close, next(self._seq), STOP_TIMEOUT, on_step)
+
+        self.last_teardown = {"steps": steps, "seconds": time.time() - start}
+        self._check_closed(steps)
+
+        logger.info("Closed service %s in %.3f s (%s)",
+                    self.service_id, self.last_teardown["seconds"], ", ".join(step for step, _, _ in steps))
+
+    def _check_closed(self, steps):
+        if SensingServiceHandle.abandoned(steps):
+            self.logger.error(
+                "Worker of service %s could not be stopped, abandoning it", self.service_id)
+
+    async def wait_closed(self):
+        """Wait for the worker being closed, if there is one."""
+        if self._teardown is not None:
+            await asyncio.shield(self._teardown)
+
+    @property
+    def health(self):
         if self.status == SERVICE_STATUS.STOPPED_ILL:
-            return False
+            return HEALTH_STATUS.DEAD
 
-        if len(self._metric_events) > 200 and self._metric_events.count(True) / len(self._metric_events) < 0.1:
+        return self.stats.health()
+
+    @property
+    def needs_restart(self):
+        """Whether the supervisor should (try to) restart the service."""
+        if not self.should_reboot or self.is_starting or self.is_waiting_to_reboot:
             return False
 
-        return True
+        return not self.is_running or not self.is_healthy
+
+    @property
+    def is_healthy(self):
+        # a slow service which still answers now and then is left running,
+        # only a dead one is restarted
+        return self.health != HEALTH_STATUS.DEAD
+
+    def _attach_reader(self):
+        """
+        Watch the service's pipe from the event loop for as long as it
+        runs, handing each reply to the request waiting on it.
+        """
+        self._stream_messages.clear()
+
+        self._reader_loop = asyncio.get_running_loop()
+        self._reader_fd = self.active_handle.recv_pipe.fileno()
+        self._reader_loop.add_reader(self._reader_fd, self._dispatch_replies)
+
+    def _detach_reader(self, error):
+        """Stop watching the pipe, failing any request still waiting with error."""
+        if self._reader_loop is None:
+            return
+
+        loop = self._reader_loop
+        self._reader_loop = None
 
-    async def _spin_for_response(self, timeout, sleep_increment=0.1):
-        start_time = datetime.now()
-        while True:
-            if (datetime.now() - start_time).total_seconds() > timeout:
-                self.logger.debug(
-                    "Service {} did not respond to heartbeat in time".format(self.service_id))
-                raise TimeoutError(
-                    "Service {} did not respond to heartbeat in time".format(self.service_id))
+        pending = list(self._pending.values())
+        self._pending.clear()
+
+        if loop.is_closed():
+            return
+
+        loop.remove_reader(self._reader_fd)
+
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def _dispatch_replies(self):
+        """
+        Read everything waiting on the pipe. Replies resolve the request
+        with the same sequence number, replies nobody is waiting for any
+        more are discarded, and streamed batches are kept for collect_stream.
+        """
+        recv_pipe = self.active_handle.recv_pipe
+
+        try:
+            while recv_pipe.poll():
+                message = recv_pipe.recv()
+
+                if not isinstance(message, tuple) or len(message) != 3:
+                    self.logger.warning("Service %s sent a malformed message: %s",
+                                        self.service_id, message)
+                    continue
+
+                message_type, seq, payload = message
+
+                if message_type == STATUS_MESSAGES.STREAM_DATA.value:
+                    self._stream_messages.append(payload)
+                    continue
+
+                future = self._pending.pop(seq, None)
+                if future is None or future.done():
+                    self.stale_replies += 1
+                    self.logger.debug("Service %s discarded stale reply %s to request %s",
+                                      self.service_id, message_type, seq, extra=self._sampled)
+                    continue
+
+                future.set_result((message_type, payload))
+
+        except (EOFError, OSError) as e:
+            error = ServiceError(
+                "Service {} pipe closed: {}".format(self.service_id, e), critical=True, kind="pipe_closed")
+
+            had_pending = bool(self._pending)
+            self._detach_reader(error)
+
+            # otherwise the waiting requests report it
+            if not had_pending:
+                self.handle_error(error)
+
+    async def _request(self, message_type, payload=None, timeout=None):
+        """
+        Send a request tagged with a fresh sequence number and wait for the
+        reply carrying the same number. Several requests can be in flight
+        at once. Returns the reply as (message type, payload).
+        """
+        if self.active_handle is None or self._reader_loop is None:
+            raise ServiceError(
+                "Service {} is not running".format(self.service_id), kind="not_running")
 
-            if self.active_handle.recv_pipe.poll():
-                break
+        seq = next(self._seq)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[seq] = future
 
-            await asyncio.sleep(sleep_increment)
+        try:
+            self.active_handle.send_pipe.send(
+                (message_type.value, seq, payload))
+
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.logger.debug(
+                "Service %s did not respond in time", self.service_id, extra=self._sampled)
+            raise TimeoutError(
+                "Service {} did not respond in time".format(self.service_id))
+        finally:
+            self._pending.pop(seq, None)
 
     async def get_data(self, data_timeout=0.5):
         """
@@ -102,52 +374,33 @@ class ServiceDelegate:
 
         try:
 
-            if self.active_handle is None:
-                raise ServiceError(
-                    "Service {} is not running".format(self.service_id))
-
-            send_pipe = self.active_handle.send_pipe
-            recv_pipe = self.active_handle.recv_pipe
+            # the service skips the read if it only gets to it after this
+            request = {"deadline": time.time() + data_timeout}
 
-            send_pipe.send((
-                STATUS_MESSAGES.GET_DATA.value,
-            ))
+            logger.debug("Sent get data to service %s", self.service_id, extra=self._sampled)
 
-            logger.debug("Sent get data to service {}".format(self.service_id))
+            start = time.time()
 
-            await self._spin_for_response(data_timeout, sleep_increment=data_timeout/10)
-
-            response = recv_pipe.recv()
+            status_message_type, status_message_data = await self._request(
+                STATUS_MESSAGES.GET_DATA, request, data_timeout)
 
             logger.debug(
-                "Received data from service {}".format(self.service_id))
-
-            if not isinstance(response, tuple) or len(response) != 2:
-
-                raise ServiceError(
-                    "Service {} did not respond with a tuple of (status, data)".format(self.service_id), critical=True)
-
-            status_message_type, status_message_data = response
+                "Received data from service %s", self.service_id, extra=self._sampled)
 
             if status_message_type == STATUS_MESSAGES.DATA_ERROR.value:
-                err = None
-                if len(response) == 2:
-                    err = response[1]
-
                 raise ServiceError(
-                    "Service {} returned an error: {}".format(self.service_id, err))
+                    "Service {} returned an error: {}".format(self.service_id, status_message_data), kind="data_error")
 
             if status_message_type != STATUS_MESSAGES.DATA_OK.value:
 
                 raise ServiceError(
-                    "Service {} did not return a valid response".format(self.service_id))
+                    "Service {} did not return a valid response".format(self.service_id), kind="bad_response")
 
-            self._report_event(True)
+            self.stats.record_success(time.time() - start)
             return status_message_data
 
         except Exception as e:
-            logger.debug("Error during get_data in {}: {}".format(
-                self.service_id, e))
+            logger.debug("Error during get_data in %s: %s", self.service_id, e, extra=self._sampled)
 
             self.handle_error(e)
 
@@ -157,59 +410,223 @@ class ServiceDelegate:
         logger = self.logger
 
         try:
-            send_pipe = self.active_handle.send_pipe
-            recv_pipe = self.active_handle.recv_pipe
-            send_pipe.send(
-                (STATUS_MESSAGES.HEARTBEAT_SYN.value, None))
-
             logger.debug(
-                "Sent heartbeat to service {}".format(self.service_id))
-
-            await self._spin_for_response(HEARTBEAT_TIMEOUT)
+                "Sent heartbeat to service %s", self.service_id)
 
-            # wait for ack
+            start = time.time()
+            response_type, response_data = await self._request(
+                STATUS_MESSAGES.HEARTBEAT_SYN, timeout=HEARTBEAT_TIMEOUT)
 
             logger.debug(
-                "Received heartbeat ack from service {}".format(self.service_id))
-            response = recv_pipe.recv()
-
-            if not isinstance(response, tuple) or not (1 <= len(response) <= 2):
-                raise ServiceError(
-                    "Service {} did not return a correct tuple to challenge".format(self.service_id))
-
-            if response[0] == STATUS_MESSAGES.STARTUP_ERROR.value:
-                err = None
-                if len(response) == 2:
-                    err = response[1]
+                "Received heartbeat ack from service %s", self.service_id)
 
+            if response_type == STATUS_MESSAGES.STARTUP_ERROR.value:
                 raise ServiceError("Service {} returned an error during startup: {}".format(
-                    self.service_id, err), critical=True)
+                    self.service_id, response_data), critical=True, kind="startup_error")
 
-            if response[0] != STATUS_MESSAGES.HEARTBEAT_ACK.value:
+            if response_type != STATUS_MESSAGES.HEARTBEAT_ACK.value:
 
                 raise ServiceError(
-                    "Service {}: returned no heartbeat ack.".format(self.service_id))
+                    "Service {}: returned no heartbeat ack.".format(self.service_id), kind="bad_response")
 
-            self._report_event(True)
+            self.stats.record_success(time.time() - start)
             return True
 
         except Exception as e:
 
             logger.debug(
-                "Service {}: error during heartbeat of service {}".format(self.service_id, e))
+                "Service %s: error during heartbeat of service %s", self.service_id, e)
 
             self.handle_error(e)
 
             return False
 
+    async def poll(self, sample_rate, overrun_policy=OVERRUN_POLICY.SKIP):
+        """
+        Ask the service for data at its own sample rate, keeping each
+        reading with the time it arrived in the stream buffer. Runs until
+        cancelled, waiting out any time the service isn't running.
+
+        Requests are pipelined: a slow read doesn't hold up the next tick's
+        request, up to max_outstanding_requests in flight. Each may take
+        that many periods to answer before it's given up on.
+        """
+        self.poll_rate = sample_rate
+        self.stats.expect_rate(sample_rate)
+        scheduler = TickScheduler(sample_rate, overrun_policy)
+
+        max_outstanding = MAX_OUTSTANDING_REQUESTS
+        if isinstance(self.config, dict) and self.config.get("max_outstanding_requests") is not None:
+            max_outstanding = self.config["max_outstanding_requests"]
+
+        outstanding = set()
+        try:
+            while True:
+                await scheduler.wait()
+
+                if not self.is_running or len(outstanding) >= max_outstanding:
+                    continue
+
+                request = asyncio.ensure_future(
+                    self._poll_once(max_outstanding / sample_rate))
+                outstanding.add(request)
+                request.add_done_callback(outstanding.discard)
+        finally:
+            for request in outstanding:
+                request.cancel()
+
+    async def _poll_once(self, data_timeout):
+        data = await self.get_data(data_timeout=data_timeout)
+
+        if isinstance(data, dict):
+            self.stream_buffer.append((time.time(), data))
+            self._note_arrivals((self.stream_buffer[-1][0],))
+
+    def enable_streaming(self, sample_rate, batch_interval):
+        """
+        Switch the service into streaming mode, where the worker samples
+        at its own rate and pushes batches of readings without being asked.
+        The settings are kept so the stream is resumed after a reboot.
+        """
+        self.stream_settings = {
+            "sample_rate": sample_rate,
+            "batch_interval": batch_interval
+        }
+
+        # failures come a batch at a time
+        self.stats.expect_rate(min(sample_rate, 1 / batch_interval))
+
+        if self.is_running and self.active_handle is not None:
+            self._send_start_stream()
+
+    def _send_start_stream(self):
+        stream_settings = dict(self.stream_settings)
+
+        if self.stream_transport == "shm":
+            from src.utils.ring_buffer import SampleRingBuffer, dtype_from_schema
+
+            capacity = RING_BUFFER_CAPACITY
+            if isinstance(self.config, dict) and self.config.get("ring_buffer_capacity") is not None:
+                capacity = self.config["ring_buffer_capacity"]
+
+            self._close_ring_buffer()
+            self.ring_buffer = SampleRingBuffer.create(
+                dtype_from_schema(self.service_class.get_schema()), capacity)
+            stream_settings["ring_buffer"] = self.ring_buffer.spec
+
+        # no reply expected
+        self.active_handle.send_pipe.send(
+            (STATUS_MESSAGES.START_STREAM.value, None, stream_settings))
+
+        # a stream which goes quiet is failing, see _check_stream_stalled
+        self._last_stream_data = time.time()
+        self._last_no_data = None
+
+        self.logger.info("Started stream from service %s at %s Hz",
+                         self.service_id, self.stream_settings["sample_rate"])
+
+    def _close_ring_buffer(self):
+        if self.ring_buffer is not None:
+            self.ring_buffer.close()
+            self.ring_buffer = None
+
+    def collect_stream(self):
+        """
+        Drain every batch the worker has pushed so far into the stream buffer.
+        Returns the list of new (timestamp, data) samples, or with the shm
+        transport a structured array view of the new records.
+        """
+        new_samples = []
+
+        if self.active_handle is None:
+            return new_samples
+
+        while self._stream_messages:
+            for timestamp, status, payload in self._stream_messages.popleft():
+                if status == STATUS_MESSAGES.DATA_OK.value:
+                    new_samples.append((timestamp, payload))
+                else:
+                    self.handle_error(ServiceError(
+                        "Service {} returned an error: {}".format(self.service_id, payload), kind="data_error"))
+
+        self.stream_buffer.extend(new_samples)
+        self._note_arrivals(timestamp for timestamp, _ in new_samples)
+        if new_samples:
+            self.stats.record_success(n=len(new_samples))
+            self._last_stream_data = time.time()
+
+        if self.ring_buffer is not None:
+            new_records = self.ring_buffer.read_new()
+            if len(new_records):
+                self.stats.record_success(n=len(new_records))
+                self._last_stream_data = time.time()
+            else:
+                self._check_stream_stalled()
+            return new_records
+
+        if not new_samples:
+            self._check_stream_stalled()
+
+        return new_samples
+
+    def _check_stream_stalled(self):
+        """
+        A worker stuck in a read sends nothing, so no failures either. Once
+        its stream is stale, count a failure for every period it should have
+        sent something in, so the health (and the supervisor) catch it.
+        """
+        if not self.is_running or self._last_stream_data is None:
+            return
+
+        now = time.time()
+        if now - self._last_stream_data <= self.stale_after:
+            return
+
+        period = max(1 / self.stream_settings["sample_rate"], self.stream_settings["batch_interval"])
+        if self._last_no_data is not None and now - self._last_no_data < period:
+            return
+
+        self._last_no_data = now
+        self.handle_error(ServiceError(
+            "Service {} sent no data for {:.1f} s".format(self.service_id, now - self._last_stream_data),
+            kind="no_data"))
+
+    def samples_around(self, timestamp):
+        """
+        The samples either side of timestamp, as (newest at or before,
+        oldest after). Either may be None.
+        """
+        if self.ring_buffer is not None:
+            return self.ring_buffer.samples_around(timestamp)
+
+        after = None
+        for sample in reversed(self.stream_buffer):
+            if sample[0] <= timestamp:
+                return sample, after
+            after = sample
+
+        return None, after
+
     def handle_error(self, e):
         """report error, give to list etc. TODO"""
 
+        # cut off by our own stop or restart, not the service's doing
+        if isinstance(e, ServiceError) and e.kind == "stopped":
+            return
+
         self.last_error = e
 
+        if isinstance(e, ServiceError):
+            kind = e.kind
+        elif isinstance(e, TimeoutError):
+            kind = "timeout"
+        else:
+            kind = type(e).__name__
+        self.stats.record_failure(kind)
+
         def crit():
             self.logger.error(
-                "Critical error causing service to stop received during service operation {}: {}".format(self.service_id, e))
+                "Critical error causing service to stop received during service operation %s: %s", self.service_id, e)
             self.stop(True)
 
         if isinstance(e, ServiceError):
@@ -222,37 +639,61 @@ class ServiceDelegate:
             crit()
             return
 
-        # todo add to metrics
-        self._report_event(False)
-
-    def _report_event(self, positive):
-        """For metrics"""
-        self._metric_events.append(positive)
-
     async def start(self, is_manual=False):
         logger = self.logger
 
-        if self.is_running:
+        if self.is_running or self.is_starting:
             raise Exception(
                 "Service {} already started".format(self.service_id))
 
-        _recv_pipe_main, _send_pipe_main = Pipe(
-            duplex=False)
-        _recv_pipe_sensor, _send_pipe_sensor = Pipe(
-            duplex=False)
+        # e.g. a manual start straight after a stop
+        await self.wait_closed()
+
+        start_time = time.time()
+        self.startup_time = None
 
-        self.active_handle = SensingServiceHandle(
-            send_pipe=_send_pipe_main,
-            recv_pipe=_recv_pipe_sensor,
-            process=self.service_class(
-                self.config, _send_pipe_sensor, _recv_pipe_main
-            ))
+        if self.stream_transport == "shm":
+            from src.utils.ring_buffer import share_resource_tracker
+            share_resource_tracker()
+
+        try:
+            if self.isolated:
+                _recv_pipe_main, _send_pipe_main = Pipe(
+                    duplex=False)
+                _recv_pipe_sensor, _send_pipe_sensor = Pipe(
+                    duplex=False)
+
+                process = self.service_class(
+                    self.config, _send_pipe_sensor, _recv_pipe_main
+                )
+            else:
+                _recv_pipe_main, _send_pipe_main = LocalPipe()
+                _recv_pipe_sensor, _send_pipe_sensor = LocalPipe()
+
+                process = ServiceThread(self.service_class(
+                    self.config, _send_pipe_sensor, _recv_pipe_main
+                ), stop_pipe=_send_pipe_main)
+
+            self.active_handle = SensingServiceHandle(
+                send_pipe=_send_pipe_main,
+                recv_pipe=_recv_pipe_sensor,
+                process=process)
+
+            self.active_handle.process.start()
+        except Exception as e:
+            # e.g. the service couldn't be built or forked, record why so
+            # the startup report and the supervisor see it
+            self.handle_error(ServiceError(
+                "Service {} failed to start: {!r}".format(self.service_id, e), critical=True, kind="startup_error"))
+            return
 
-        self.active_handle.process.start()
+        self._attach_reader()
 
-        logger.info("Started service {}".format(self.service_id))
+        logger.info("Started service %s in a %s",
+                    self.service_id, "process" if self.isolated else "thread")
 
-        self.status = SERVICE_STATUS.RUNNING
+        # not sampled until it's answered a heartbeat
+        self.status = SERVICE_STATUS.STARTING
 
         # if manually started, make sure to turn on restart!
         if is_manual:
@@ -268,26 +709,39 @@ class ServiceDelegate:
             self.status = SERVICE_STATUS.STOPPED
 
             self.stop(True)
+            return
+
+        self.status = SERVICE_STATUS.RUNNING
+        self.startup_time = time.time() - start_time
+
+        # judged afresh, not on the failures which got it restarted
+        self.stats.reset_window()
+
+        logger.info("Service %s up after %.3f s", self.service_id, self.startup_time)
+
+        if self.is_streaming:
+            self.stream_buffer.clear()
+            self._send_start_stream()
 
     async def try_reboot(self):
 
         logger = self.logger
 
-        logger.info("TRYING RESTART {}".format(self.service_id))
+        logger.info("TRYING RESTART %s", self.service_id)
 
         if self.is_running:
             logger.info(
-                "Service {} already running, not restarting".format(self.service_id))
+                "Service %s already running, not restarting", self.service_id)
             return
 
         if not self.should_reboot:
             logger.info(
-                "Service {} not configured to restart".format(self.service_id))
+                "Service %s not configured to restart", self.service_id)
             return
 
         if self.reboot_attempts >= len(REBOOT_LOOKUP_TIMEOUTS):
             logger.warning(
-                "Service {} exceeded max reboot attempts, not restarting".format(self.service_id))
+                "Service %s exceeded max reboot attempts, not restarting", self.service_id)
 
             self.should_reboot = False
             return
@@ -295,20 +749,41 @@ class ServiceDelegate:
         if self.last_reboot is not None and (self.last_reboot + timedelta(
                 seconds=REBOOT_LOOKUP_TIMEOUTS[self.reboot_attempts])) > datetime.now():
             logger.debug(
-                "Service {} reboot not due, not restarting".format(self.service_id))
+                "Service %s reboot not due, not restarting", self.service_id)
             return
 
         # this will prevent the restarting of the service temporarily
         self.status = SERVICE_STATUS.WAITING_TO_REBOOT
 
-        logger.info("Trying to restart service {}, attempt num: {}".format(
-            self.service_id, self.reboot_attempts))
+        logger.info("Trying to restart service %s, attempt num: %s",
+                    self.service_id, self.reboot_attempts)
 
         self.reboot_attempts += 1
+        self.restarts += 1
         self.last_reboot = datetime.now()
 
         return await self.start()
 
+    async def restart(self):
+        """
+        Stop the service if it's still up, closing its worker off the event
+        loop so sampling carries on meanwhile, then try to start it again
+        (subject to the reboot backoff).
+        """
+        if self.active_handle is not None:
+            self.stop()
+
+        # the old worker has to be gone first, e.g. to free its port
+        await self.wait_closed()
+
+        await self.try_reboot()
+
+    async def shutdown(self):
+        """Stop the service for good and wait for its worker to be closed."""
+        self.should_reboot = False
+        self.stop()
+        await self.wait_closed()
+
     def stop(self, ill=False):
 
         self.terminate_handle()
@@ -0,0 +1,199 @@
+import bisect
+import time
+
+
+class HEALTH_STATUS:
+    OK = 0
+    # answering, but mostly failing or timing out, e.g. a slow sensor
+    UNHEALTHY_WITH_SUCCESS = 1
+    # nothing but failures
+    DEAD = 2
+
+
+# rolling window health is judged over, in buckets of BUCKET_SECONDS
+WINDOW_SECONDS = 30
+BUCKET_SECONDS = 1
+
+# events in the window needed before a service can be judged unhealthy,
+# until its rate is known (see expect_rate)
+MIN_WINDOW_EVENTS = 200
+
+# once it is, the events it should have in this much of the window, so a
+# short glitch doesn't get a fast service restarted, but at least
+MIN_WINDOW_FRACTION = 0.5
+MIN_WINDOW_EVENTS_FLOOR = 3
+
+# below this success rate a service which still has successes is unhealthy
+MIN_SUCCESS_RATE = 0.1
+
+# weight of the newest latency in the moving average
+LATENCY_EWMA_ALPHA = 0.1
+
+# upper bounds (s) of the request latency histogram's buckets, the last
+# bucket takes everything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class ServiceStats:
+    """
+    Rolling statistics of one service's requests and samples. Events land
+    in per second buckets of a fixed ring, with running totals of the
+    window, so recording an event and asking for the health are both O(1)
+    (moving on a bucket clears the ones passed, at most the ring's length,
+    once per second).
+    """
+
+    def __init__(self, window_seconds=WINDOW_SECONDS, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.n_buckets = max(1, int(window_seconds / bucket_seconds))
+
+        self.min_window_events = MIN_WINDOW_EVENTS
+
+        self._successes = [0] * self.n_buckets
+        self._failures = [0] * self.n_buckets
+        self._bucket = None
+        self._window_start = None
+
+        # totals over the window
+        self.window_successes = 0
+        self.window_failures = 0
+
+        # totals since the service was registered
+        self.successes = 0
+        self.failures = 0
+        self.errors = {}
+
+        self.latency_ewma = None
+        self.last_latency = None
+
+        # request latencies since the service was registered
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0
+
+        self.last_success_time = None
+        self.last_failure_time = None
+        self.consecutive_failures = 0
+
+    def _advance(self, now):
+        bucket = int(now / self.bucket_seconds)
+
+        if self._bucket is None:
+            self._bucket = bucket
+            self._window_start = now
+            return bucket % self.n_buckets
+
+        # clear the buckets passed since the last event, they've left the window
+        for passed in range(self._bucket + 1, min(bucket, self._bucket + self.n_buckets) + 1):
+            i = passed % self.n_buckets
+            self.window_successes -= self._successes[i]
+            self.window_failures -= self._failures[i]
+            self._successes[i] = 0
+            self._failures[i] = 0
+
+        self._bucket = max(bucket, self._bucket)
+        return self._bucket % self.n_buckets
+
+    def record_success(self, latency=None, n=1, now=None):
+        """n successful samples or replies, latency in seconds if it was a request."""
+        now = time.time() if now is None else now
+        i = self._advance(now)
+
+        self._successes[i] += n
+        self.window_successes += n
+        self.successes += n
+
+        self.last_success_time = now
+        self.consecutive_failures = 0
+
+        if latency is not None:
+            self.last_latency = latency
+            self.latency_ewma = latency if self.latency_ewma is None else \
+                self.latency_ewma + LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+
+            self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+
+    def record_failure(self, kind, now=None):
+        """A failed request or sample, kind e.g. "timeout"."""
+        now = time.time() if now is None else now
+        i = self._advance(now)
+
+        self._failures[i] += 1
+        self.window_failures += 1
+        self.failures += 1
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+        self.last_failure_time = now
+        self.consecutive_failures += 1
+
+    def expect_rate(self, rate):
+        """Events expected per second, which sets how many the health needs."""
+        self.min_window_events = max(
+            MIN_WINDOW_EVENTS_FLOOR, int(rate * self.n_buckets * self.bucket_seconds * MIN_WINDOW_FRACTION))
+
+    def reset_window(self):
+        """Forget the window, e.g. after a restart, keeping the totals."""
+        self._successes = [0] * self.n_buckets
+        self._failures = [0] * self.n_buckets
+        self._bucket = None
+        self._window_start = None
+        self.window_successes = 0
+        self.window_failures = 0
+        self.consecutive_failures = 0
+
+    def success_rate(self, now=None):
+        """Fraction of the window's events which succeeded, None if there were none."""
+        self._advance(time.time() if now is None else now)
+
+        total = self.window_successes + self.window_failures
+        if total == 0:
+            return None
+
+        return self.window_successes / total
+
+    def sample_rate(self, now=None):
+        """Successful samples per second over the window (or as much of it as has passed)."""
+        now = time.time() if now is None else now
+        self._advance(now)
+
+        if self._window_start is None:
+            return 0
+
+        elapsed = min(now - self._window_start, self.n_buckets * self.bucket_seconds)
+        return self.window_successes / max(elapsed, self.bucket_seconds)
+
+    def health(self, now=None):
+        """A HEALTH_STATUS, from the window's events."""
+        self._advance(time.time() if now is None else now)
+
+        total = self.window_successes + self.window_failures
+        if total < self.min_window_events:
+            return HEALTH_STATUS.OK
+
+        if self.window_successes == 0:
+            return HEALTH_STATUS.DEAD
+
+        if self.window_successes / total < MIN_SUCCESS_RATE:
+            return HEALTH_STATUS.UNHEALTHY_WITH_SUCCESS
+
+        return HEALTH_STATUS.OK
+
+    def snapshot(self, now=None):
+        now = time.time() if now is None else now
+        success_rate = self.success_rate(now)
+
+        return {
+            "health": self.health(now),
+            "window_s": self.n_buckets * self.bucket_seconds,
+            "success_rate": success_rate,
+            "sample_rate": self.sample_rate(now),
+            "window_successes": self.window_successes,
+            "window_failures": self.window_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "errors": dict(self.errors),
+            "latency_ewma_ms": None if self.latency_ewma is None else 1000 * self.latency_ewma,
+            "last_latency_ms": None if self.last_latency is None else 1000 * self.last_latency,
+            "since_success_s": None if self.last_success_time is None else now - self.last_success_time,
+            "consecutive_failures": self.consecutive_failures,
+        }
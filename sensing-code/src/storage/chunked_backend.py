@@ -0,0 +1,208 @@
+"""
+Chunked, compressed, columnar storage for sensor rows.
+
+File layout:
+
+    MAGIC | u32 header length | JSON header (dtype descr)
+    chunk | chunk | ...
+
+where each chunk is
+
+    u32 payload length | u32 row count | u32 crc32 of payload | payload
+
+and the payload is the zlib compressed concatenation of each column's raw
+bytes for that chunk. Chunks are only ever appended, so after a crash or
+power loss everything but a partially written final chunk can be read
+back; that chunk fails its length/crc check and is dropped (and truncated
+away when the file is next opened for writing).
+"""
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from ..sensor_services.schema import fill_value
+
+
+MAGIC = b"SENSCHK1"
+
+HEADER_LENGTH = struct.Struct("<I")
+CHUNK_HEADER = struct.Struct("<III")
+
+COMPRESSION_LEVEL = 6
+
+
+def rows_to_array(rows, dtype):
+    """
+    Pack a list of row dicts into a structured array. Missing or
+    unconvertible values become the column's fill value.
+    """
+    array = np.empty(len(rows), dtype=dtype)
+
+    for name in dtype.names:
+        fill = fill_value(dtype.fields[name][0].str)
+        column = [row.get(name, fill) for row in rows]
+
+        try:
+            array[name] = column
+        except (ValueError, TypeError, OverflowError):
+            # one bad value, fall back to converting one by one
+            for i, value in enumerate(column):
+                try:
+                    array[name][i] = value
+                except (ValueError, TypeError, OverflowError):
+                    array[name][i] = fill
+
+    return array
+
+
+def _read_header(handle):
+    if handle.read(len(MAGIC)) != MAGIC:
+        raise ValueError("{} is not a chunked sensor file".format(handle.name))
+
+    (header_length,) = HEADER_LENGTH.unpack(handle.read(HEADER_LENGTH.size))
+    header = json.loads(handle.read(header_length).decode("utf-8"))
+
+    dtype = np.dtype([tuple(field) for field in header["dtype"]])
+
+    return header, dtype
+
+
+def _iter_chunks(handle, dtype):
+    """
+    Yield (offset, structured array) for every intact chunk, stopping at
+    the first truncated or corrupt one.
+    """
+    while True:
+        offset = handle.tell()
+
+        chunk_header = handle.read(CHUNK_HEADER.size)
+        if len(chunk_header) < CHUNK_HEADER.size:
+            return
+
+        payload_length, n_rows, crc = CHUNK_HEADER.unpack(chunk_header)
+        payload = handle.read(payload_length)
+
+        if len(payload) < payload_length or zlib.crc32(payload) != crc:
+            return
+
+        raw = zlib.decompress(payload)
+
+        array = np.empty(n_rows, dtype=dtype)
+        position = 0
+        for name in dtype.names:
+            column = array[name]
+            column[:] = np.frombuffer(
+                raw, dtype=column.dtype, count=n_rows, offset=position)
+            position += column.nbytes
+
+        yield offset, array
+
+
+def read_chunked(filename, from_offset=None, to_offset=None):
+    """
+    Read a chunked file back as one structured array. from_offset and
+    to_offset (chunk offsets, e.g. from the time index) limit it to the
+    chunks in between.
+    """
+    with open(filename, "rb") as handle:
+        _, dtype = _read_header(handle)
+
+        if from_offset:
+            handle.seek(from_offset)
+
+        chunks = []
+        for offset, array in _iter_chunks(handle, dtype):
+            if to_offset is not None and offset >= to_offset:
+                break
+            chunks.append(array)
+
+    if not chunks:
+        return np.empty(0, dtype=dtype)
+
+    return np.concatenate(chunks)
+
+
+def load_dataframe(filename):
+    """Read a chunked file into a pandas DataFrame."""
+    import pandas as pd
+
+    return pd.DataFrame(read_chunked(filename))
+
+
+class ChunkedBackend:
+    """
+    Appends each batch of rows as one compressed columnar chunk.
+    """
+
+    extension = ".chunked"
+
+    # already compressed, so not worth gzipping when rotated out
+    compressed = True
+
+    def __init__(self, filename, schema):
+        self.filename = filename
+        self.schema = schema
+        self.dtype = schema.numpy_dtype()
+
+        self.handle = open(filename, "a+b")
+
+        if self.handle.tell() == 0:
+            self._write_header()
+        else:
+            self._recover()
+
+    def _write_header(self):
+        header = json.dumps({"dtype": self.dtype.descr}).encode("utf-8")
+
+        self.handle.write(MAGIC)
+        self.handle.write(HEADER_LENGTH.pack(len(header)))
+        self.handle.write(header)
+        self.handle.flush()
+
+    def _recover(self):
+        """
+        Appending to an existing file, check it matches our layout and cut
+        off any partial chunk left by a crash.
+        """
+        self.handle.seek(0)
+        _, dtype = _read_header(self.handle)
+
+        if dtype != self.dtype:
+            raise ValueError(
+                "{} was written with a different schema".format(self.filename))
+
+        end = self.handle.tell()
+        for _ in _iter_chunks(self.handle, dtype):
+            end = self.handle.tell()
+
+        self.handle.truncate(end)
+        self.handle.seek(end)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+
+        array = rows_to_array(rows, self.dtype)
+
+        payload = zlib.compress(
+            b"".join(array[name].tobytes() for name in self.dtype.names),
+            COMPRESSION_LEVEL)
+
+        self.handle.write(CHUNK_HEADER.pack(
+            len(payload), len(array), zlib.crc32(payload)))
+        self.handle.write(payload)
+        self.handle.flush()
+
+    def tell(self):
+        """Offset the next chunk will be written at."""
+        return self.handle.tell()
+
+    def sync(self):
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        self.handle.close()
+
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+"""
+Convert chunked sensor files to CSV.
+
+    python -m src.storage.convert data/20220124/10_30.chunked [out.csv]
+
+Without an output path the CSV is written next to the input file, where
+list_segments() knows it for a conversion rather than a segment.
+"""
+import csv
+import sys
+
+from .chunked_backend import read_chunked
+
+
+def chunked_to_csv(filename, csv_filename=None):
+
+    if csv_filename is None:
+        csv_filename = filename.rsplit(".", 1)[0] + ".csv"
+
+    array = read_chunked(filename)
+
+    with open(csv_filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(array.dtype.names)
+        writer.writerows(array.tolist())
+
+    return csv_filename
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m src.storage.convert <file.chunked> [out.csv]")
+        sys.exit(1)
+
+    print("Wrote {}".format(chunked_to_csv(*sys.argv[1:3])))
@@ -0,0 +1,35 @@
+import csv
+import os
+
+
+class CsvBackend:
+    """
+    Writes rows as plain CSV, one line per row, with a header.
+    """
+
+    extension = ".csv"
+
+    def __init__(self, filename, schema):
+        self.filename = filename
+        self.schema = schema
+
+        self.handle = open(filename, "a", newline="")
+        self.wrtr = csv.DictWriter(self.handle, schema.keys)
+
+        # if at start of file
+        if self.handle.tell() == 0:
+            self.wrtr.writeheader()
+
+    def write_rows(self, rows):
+        self.wrtr.writerows(rows)
+        self.handle.flush()
+
+    def tell(self):
+        """Byte offset the next row will be written at."""
+        return self.handle.tell()
+
+    def sync(self):
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        self.handle.close()
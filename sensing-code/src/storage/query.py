@@ -0,0 +1,139 @@
+#!/usr/bin/python
+"""
+Pull a time window out of the recorded data without reading everything.
+
+    python -m src.storage.query 14:03 14:05
+    python -m src.storage.query --date 20220124 14:03:30 14:04 --csv out.csv
+
+Times are HH:MM[:SS] on --date (default today), ISO datetimes or unix
+timestamps. Segments outside the window are skipped using their index
+and within a segment the time index is used to seek to the window.
+"""
+import argparse
+from datetime import datetime
+import gzip
+import io
+import warnings
+
+import numpy as np
+from numpy.lib import recfunctions
+
+from .chunked_backend import read_chunked
+from .rotation import find_segments
+from .time_index import read_time_index, seek_range
+
+
+def _read_csv_segment(segment, from_offset, to_offset):
+    opener = gzip.open if segment.endswith(".gz") else open
+
+    with opener(segment, "rb") as f:
+        header = f.readline()
+
+        if from_offset > f.tell():
+            f.seek(from_offset)
+
+        if to_offset is None:
+            data = f.read()
+        else:
+            data = f.read(max(to_offset - f.tell(), 0))
+
+    if not data.strip():
+        return None
+
+    with warnings.catch_warnings():
+        # empty columns, e.g. a service which was down
+        warnings.simplefilter("ignore")
+        return np.atleast_1d(np.genfromtxt(
+            io.BytesIO(header + data), delimiter=",", names=True, dtype=None, encoding="utf-8"))
+
+
+def read_segment_range(segment, start=None, end=None):
+    """Rows of one segment with start <= time_ms <= end, as a structured array."""
+    from_offset, to_offset = seek_range(read_time_index(segment), start, end)
+
+    if segment.endswith(".chunked"):
+        array = read_chunked(segment, from_offset, to_offset)
+    else:
+        array = _read_csv_segment(segment, from_offset, to_offset)
+
+    if array is None or len(array) == 0:
+        return None
+
+    mask = np.ones(len(array), dtype=bool)
+    if start is not None:
+        mask &= array["time_ms"] >= start
+    if end is not None:
+        mask &= array["time_ms"] <= end
+
+    return array[mask]
+
+
+def read_range(data_dir="data", start=None, end=None):
+    """
+    Every recorded row with start <= time_ms <= end (unix seconds) as a
+    structured array, or None if there are none.
+    """
+    arrays = []
+    for segment in find_segments(data_dir, start, end):
+        array = read_segment_range(segment, start, end)
+        if array is not None and len(array) > 0:
+            arrays.append(array)
+
+    if not arrays:
+        return None
+
+    try:
+        return np.concatenate(arrays)
+    except TypeError:
+        # segments with different columns or column types
+        return recfunctions.stack_arrays(arrays, usemask=False, autoconvert=True)
+
+
+def load_range(data_dir="data", start=None, end=None):
+    """As read_range, but as a pandas DataFrame."""
+    import pandas as pd
+
+    array = read_range(data_dir, start, end)
+    if array is None:
+        return pd.DataFrame()
+
+    return pd.DataFrame(array)
+
+
+def parse_time(value, date):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    for time_format in ("%H:%M:%S", "%H:%M"):
+        try:
+            t = datetime.strptime(value, time_format).time()
+            return datetime.combine(date, t).timestamp()
+        except ValueError:
+            pass
+
+    return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read recorded sensor data between two times")
+    parser.add_argument("start")
+    parser.add_argument("end")
+    parser.add_argument("--date", help="YYYYMMDD, for HH:MM times",
+                        default=datetime.now().strftime("%Y%m%d"))
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--csv", help="write the rows to this csv file")
+    args = parser.parse_args()
+
+    date = datetime.strptime(args.date, "%Y%m%d").date()
+
+    df = load_range(args.data_dir, parse_time(args.start, date),
+                    parse_time(args.end, date))
+
+    if args.csv is not None:
+        df.to_csv(args.csv, index=False)
+        print("Wrote {} rows to {}".format(len(df), args.csv))
+    else:
+        print(df)
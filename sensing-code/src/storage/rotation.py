@@ -0,0 +1,263 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import glob
+import gzip
+import json
+import os
+import pathlib
+import shutil
+import time
+
+from .time_index import INDEX_SUFFIX as TIME_INDEX_SUFFIX, TimeIndexWriter
+
+INDEX_SUFFIX = ".index.json"
+
+# extensions of data segments, as opposed to logs etc. in the same directory
+SEGMENT_EXTENSIONS = (".csv", ".csv.gz", ".chunked")
+
+
+class RotationPolicy:
+    """
+    When the data logger starts a new segment file, and how closed
+    segments are kept.
+
+    :param max_segment_seconds: Start a new segment after this long.
+    :param max_segment_bytes: Start a new segment once one is this big.
+    :param compress_closed: gzip closed segments in the background, for
+                            formats which aren't already compressed.
+    :param min_free_bytes: Delete the oldest closed segments while the
+                           disk has less than this free.
+    """
+
+    def __init__(self, max_segment_seconds=3600, max_segment_bytes=None, compress_closed=True, min_free_bytes=None):
+        self.max_segment_seconds = max_segment_seconds
+        self.max_segment_bytes = max_segment_bytes
+        self.compress_closed = compress_closed
+        self.min_free_bytes = min_free_bytes
+
+    def __repr__(self):
+        return "RotationPolicy(max_segment_seconds={}, max_segment_bytes={}, compress_closed={}, min_free_bytes={})".format(
+            self.max_segment_seconds, self.max_segment_bytes, self.compress_closed, self.min_free_bytes)
+
+
+def read_index(segment_filename):
+    """The index of a closed segment, or None if it has none (e.g. still open)."""
+    try:
+        with open(segment_filename + INDEX_SUFFIX, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def list_segments(data_dir):
+    """Every data segment under data_dir, oldest first."""
+    segments = []
+    for extension in SEGMENT_EXTENSIONS:
+        segments += glob.glob("{}/*/*{}".format(data_dir, extension))
+
+    # a CSV next to a chunked segment of the same name is a conversion of it
+    # (see convert.py), not a segment of its own
+    chunked = {segment[:-len(".chunked")] for segment in segments if segment.endswith(".chunked")}
+    segments = [segment for segment in segments
+                if not (segment.endswith(".csv") and segment[:-len(".csv")] in chunked)]
+
+    # data/YYYYMMDD/HH_MM[_n] sorts chronologically
+    return sorted(segments)
+
+
+def find_segments(data_dir, start=None, end=None):
+    """
+    Segments which may hold rows with start <= time_ms <= end. Segments
+    without an index (the one being written, or one cut short by a crash)
+    are always included.
+    """
+    found = []
+    for segment in list_segments(data_dir):
+        index = read_index(segment)
+
+        if index is not None and index["rows"] > 0:
+            if start is not None and index["end"] < start:
+                continue
+            if end is not None and index["start"] > end:
+                continue
+
+        found.append(segment)
+
+    return found
+
+
+class RotatingBackend:
+    """
+    Storage backend which splits the data into data/<date>/<HH_MM> segments,
+    each written by backend_class. When a segment is closed a small index
+    is written next to it, and it's optionally compressed. Runs on the
+    data logger's writer thread, so none of this blocks acquisition.
+    """
+
+    def __init__(self, data_dir, backend_class, schema, policy=None, index_every=100):
+        self.data_dir = data_dir
+        self.backend_class = backend_class
+        self.schema = schema
+        self.policy = RotationPolicy() if policy is None else policy
+
+        # rows are written in blocks of at most this many, each with an
+        # entry in the segment's time index
+        self.index_every = index_every
+
+        self.backend = None
+        self.time_index = None
+        self.segment_filename = None
+
+        # across all segments, before any compression
+        self.bytes_written = 0
+
+        # for compressing closed segments off the writer thread
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self._open_segment()
+
+    def _new_segment_filename(self):
+        now = datetime.now()
+
+        segment_dir = "{}/{}".format(self.data_dir, now.strftime("%Y%m%d"))
+        pathlib.Path(segment_dir).mkdir(parents=True, exist_ok=True)
+
+        base = "{}/{}".format(segment_dir, now.strftime("%H_%M"))
+        filename = base + self.backend_class.extension
+
+        # a size based rotation can start two segments in one minute
+        n = 1
+        while os.path.exists(filename) or os.path.exists(filename + ".gz"):
+            filename = "{}_{}{}".format(base, n, self.backend_class.extension)
+            n += 1
+
+        return filename
+
+    def _open_segment(self):
+        self.segment_filename = self._new_segment_filename()
+        self.backend = self.backend_class(self.segment_filename, self.schema)
+        self.time_index = TimeIndexWriter(self.segment_filename)
+
+        self.segment_opened = time.time()
+        self.segment_rows = 0
+        self.segment_start = None
+        self.segment_end = None
+
+    def _close_segment(self):
+        # whatever the durability policy, a closed segment is on disk
+        self.sync()
+        self.backend.close()
+        self.time_index.close()
+
+        index = {
+            "file": os.path.basename(self.segment_filename),
+            "start": self.segment_start,
+            "end": self.segment_end,
+            "rows": self.segment_rows,
+        }
+        self._write_index(self.segment_filename, index)
+
+        if self.policy.compress_closed and not getattr(self.backend_class, "compressed", False):
+            self._executor.submit(
+                self._compress_segment, self.segment_filename, index)
+
+    @staticmethod
+    def _write_index(segment_filename, index):
+        with open(segment_filename + INDEX_SUFFIX, "w") as f:
+            json.dump(index, f)
+
+    def _compress_segment(self, segment_filename, index):
+        with open(segment_filename, "rb") as f_in, open(segment_filename + ".gz", "wb") as f_gz:
+            with gzip.GzipFile(fileobj=f_gz, mode="wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+
+            # on disk before the uncompressed segment is removed
+            os.fsync(f_gz.fileno())
+
+        index["file"] = os.path.basename(segment_filename) + ".gz"
+        self._write_index(segment_filename + ".gz", index)
+
+        # time index offsets are into the uncompressed data, which a gzip
+        # reader can still seek through
+        os.replace(segment_filename + TIME_INDEX_SUFFIX,
+                   segment_filename + ".gz" + TIME_INDEX_SUFFIX)
+
+        os.remove(segment_filename + INDEX_SUFFIX)
+        os.remove(segment_filename)
+
+    def _should_rotate(self):
+        if self.policy.max_segment_seconds is not None and \
+                time.time() - self.segment_opened >= self.policy.max_segment_seconds:
+            return True
+
+        if self.policy.max_segment_bytes is not None and \
+                os.path.getsize(self.segment_filename) >= self.policy.max_segment_bytes:
+            return True
+
+        return False
+
+    def rotate(self):
+        self._close_segment()
+        self._enforce_retention()
+        self._open_segment()
+
+    def _enforce_retention(self):
+        """Delete the oldest closed segments until there's enough free space."""
+        if self.policy.min_free_bytes is None:
+            return
+
+        # wait for any compression to finish, so we see the real usage
+        self._executor.submit(lambda: None).result()
+
+        for segment in list_segments(self.data_dir):
+            if shutil.disk_usage(self.data_dir).free >= self.policy.min_free_bytes:
+                return
+
+            if segment == self.segment_filename:
+                continue
+
+            os.remove(segment)
+            for suffix in (INDEX_SUFFIX, TIME_INDEX_SUFFIX):
+                if os.path.exists(segment + suffix):
+                    os.remove(segment + suffix)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+
+        if self._should_rotate():
+            self.rotate()
+
+        start = self.backend.tell()
+
+        for i in range(0, len(rows), self.index_every):
+            block = rows[i:i + self.index_every]
+
+            offset = self.backend.tell()
+            self.backend.write_rows(block)
+
+            # only index data that's been written
+            if block[0].get("time_ms") is not None:
+                self.time_index.append(
+                    block[0]["time_ms"], offset, self.segment_rows + i)
+
+        self.bytes_written += self.backend.tell() - start
+
+        times = [row["time_ms"] for row in rows if row.get("time_ms") is not None]
+        if times:
+            first, last = min(times), max(times)
+
+            self.segment_start = first if self.segment_start is None else min(
+                self.segment_start, first)
+            self.segment_end = last if self.segment_end is None else max(
+                self.segment_end, last)
+
+        self.segment_rows += len(rows)
+
+    def sync(self):
+        self.backend.sync()
+        self.time_index.sync()
+
+    def close(self):
+        self._close_segment()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,78 @@
+"""
+Sidecar time index for data segments.
+
+Alongside each segment a <segment>.tidx file is appended to as rows are
+written, with one fixed size record per block of at most N rows:
+
+    f8 time_ms of the block's first row | u8 byte offset | u8 row number
+
+so a time window can be found with a binary search and read by seeking
+straight to it, rather than parsing the segment from the start.
+"""
+import os
+import struct
+
+
+INDEX_SUFFIX = ".tidx"
+
+INDEX_RECORD = struct.Struct("<dQQ")
+
+# as INDEX_RECORD, for reading with numpy
+INDEX_FIELDS = [("time_ms", "<f8"), ("offset", "<u8"), ("row", "<u8")]
+
+
+class TimeIndexWriter:
+
+    def __init__(self, segment_filename):
+        self.handle = open(segment_filename + INDEX_SUFFIX, "ab")
+
+    def append(self, time_ms, offset, row):
+        self.handle.write(INDEX_RECORD.pack(time_ms, offset, row))
+        self.handle.flush()
+
+    def sync(self):
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        self.handle.close()
+
+
+def read_time_index(segment_filename):
+    """The segment's index entries, or None if it has no index."""
+    import numpy as np
+
+    try:
+        with open(segment_filename + INDEX_SUFFIX, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+
+    # ignore a partially written final entry
+    usable = len(raw) - len(raw) % INDEX_RECORD.size
+    return np.frombuffer(raw[:usable], dtype=INDEX_FIELDS)
+
+
+def seek_range(index, start=None, end=None):
+    """
+    Byte offsets (from, to) bounding the rows with start <= time_ms <= end.
+    to is None when the range runs to the end of the segment. The bounds
+    are block aligned, so the rows read still need filtering by time.
+    """
+    import numpy as np
+
+    if index is None or len(index) == 0:
+        return 0, None
+
+    from_offset = 0
+    if start is not None:
+        i = np.searchsorted(index["time_ms"], start, side="right") - 1
+        if i >= 0:
+            from_offset = int(index["offset"][i])
+
+    to_offset = None
+    if end is not None:
+        i = np.searchsorted(index["time_ms"], end, side="right")
+        if i < len(index):
+            to_offset = int(index["offset"][i])
+
+    return from_offset, to_offset
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+
+class DurabilityPolicy:
+    """
+    When buffered rows are written out.
+
+    :param flush_rows: Write once this many rows are buffered.
+    :param flush_ms: Write once the oldest buffered row is this old.
+    :param fsync: fsync the file after every write, so a written chunk
+                  survives power loss rather than just a crash.
+    """
+
+    def __init__(self, flush_rows=100, flush_ms=10000, fsync=False):
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self.fsync = fsync
+
+    def __repr__(self):
+        return "DurabilityPolicy(flush_rows={}, flush_ms={}, fsync={})".format(
+            self.flush_rows, self.flush_ms, self.fsync)
+
+
+# queue markers
+_FLUSH = object()
+_STOP = object()
+
+
+class BackgroundWriter(threading.Thread):
+    """
+    Owns a storage backend and writes rows to it from a background thread,
+    so the acquisition loop never waits on disk I/O. Rows are handed over
+    through a bounded queue; if the disk can't keep up and the queue fills,
+    new rows are dropped and counted rather than blocking.
+
+    backend may also be a function returning the backend, which is then
+    opened on the writer thread.
+    """
+
+    def __init__(self, backend, policy=None, max_queue=10000):
+        super().__init__(name="BackgroundWriter", daemon=True)
+
+        self.backend = backend
+        self.policy = DurabilityPolicy() if policy is None else policy
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._buffer = []
+        self._oldest_row_time = None
+
+        # metrics
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.last_flush_latency = 0
+        self.max_flush_latency = 0
+        self.last_error = None
+
+    def put(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.rows_dropped += 1
+
+    def flush(self):
+        """Ask the writer to write out everything buffered so far."""
+        self._queue.put(_FLUSH)
+
+    def close(self):
+        """Write out everything still queued and stop the thread."""
+        self._queue.put(_STOP)
+        self.join()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def metrics(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "buffered_rows": len(self._buffer),
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            # once the backend's open, if it counts them
+            "bytes_written": getattr(self.backend, "bytes_written", 0),
+            "flushes": self.flushes,
+            "last_flush_latency_ms": 1000 * self.last_flush_latency,
+            "max_flush_latency_ms": 1000 * self.max_flush_latency,
+        }
+
+    def run(self):
+        if callable(self.backend):
+            try:
+                self.backend = self.backend()
+            except Exception as e:
+                # rows are counted as dropped as they fail to write
+                self.last_error = e
+                self.backend = None
+
+        try:
+            while True:
+                timeout = None
+                if self._oldest_row_time is not None:
+                    timeout = max(0, self._oldest_row_time +
+                                  self.policy.flush_ms / 1000 - time.monotonic())
+
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    # the oldest buffered row is due
+                    self._write()
+                    continue
+
+                if item is _STOP:
+                    break
+
+                if item is _FLUSH:
+                    self._write()
+                    continue
+
+                if self._oldest_row_time is None:
+                    self._oldest_row_time = time.monotonic()
+                self._buffer.append(item)
+
+                if len(self._buffer) >= self.policy.flush_rows:
+                    self._write()
+        finally:
+            # drain anything queued behind the stop marker too
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP and item is not _FLUSH:
+                    self._buffer.append(item)
+
+            self._write()
+            if self.backend is not None:
+                self.backend.close()
+
+    def _write(self):
+        if not self._buffer:
+            return
+
+        start = time.monotonic()
+        try:
+            self.backend.write_rows(self._buffer)
+            if self.policy.fsync:
+                self.backend.sync()
+
+            self.rows_written += len(self._buffer)
+        except Exception as e:
+            # keep going, a full or failing disk shouldn't kill acquisition
+            self.last_error = e
+            self.rows_dropped += len(self._buffer)
+
+        self.last_flush_latency = time.monotonic() - start
+        self.max_flush_latency = max(
+            self.max_flush_latency, self.last_flush_latency)
+        self.flushes += 1
+
+        self._buffer = []
+        self._oldest_row_time = None
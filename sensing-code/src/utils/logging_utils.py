@@ -1,5 +1,9 @@
 from datetime import datetime
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
 import pathlib
+import queue
 
 __cur_logger_dir = None
 
@@ -30,3 +34,129 @@ def get_cur_logger_dir():
     __cur_logger_dir = logfile_dir
 
     return logfile_dir
+
+
+# level of the services', manager's and client's logs, e.g. INFO to drop
+# the per sample debug traces altogether
+LOG_LEVEL = os.environ.get("SENSING_LOG_LEVEL", "DEBUG")
+
+# log records waiting to be written, past this they're dropped (and counted)
+# rather than hold up sampling
+LOG_QUEUE_SIZE = 10000
+
+# at most one per sample debug record this often (s) from each line of
+# code, see DebugRateLimit
+DEBUG_INTERVAL = 1
+
+
+class BackgroundLogHandler(QueueHandler):
+    """
+    Hands log records to a thread which formats and writes them with the
+    given handlers (e.g. a FileHandler), so logging from the acquisition
+    path costs a queue put, not string formatting and a disk write. A
+    forked process starts a thread of its own with its first record.
+    """
+
+    def __init__(self, *handlers, max_queue=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(max_queue))
+
+        self.target_handlers = handlers
+        self.dropped = 0
+
+        self._listener = None
+        self._pid = None
+
+    def _start_listener(self):
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._listener = QueueListener(
+            self.queue, *self.target_handlers, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record):
+        # the record never leaves this process, so formatting it is left
+        # to the listener's thread
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._start_listener()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def flush(self):
+        """Wait for the queued records to be written."""
+        if self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+        super().close()
+
+
+def sampled(key=None):
+    """
+    The extra= for a debug call made for every sample, which DebugRateLimit
+    then rate limits. key tells apart callers sharing a logger and a line,
+    e.g. the service a delegate's trace is about.
+    """
+    return {"rate_limit_key": key}
+
+
+class DebugRateLimit(logging.Filter):
+    """
+    Lets through at most one per sample DEBUG record (see sampled()) per
+    interval from each line of code and key, so per sample traces don't
+    swamp the log files. The next one let through says how many were held
+    back. Everything else passes.
+    """
+
+    def __init__(self, interval=DEBUG_INTERVAL):
+        super().__init__()
+
+        self.interval = interval
+        self._last = {}
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or not hasattr(record, "rate_limit_key"):
+            return True
+
+        key = (record.pathname, record.lineno, record.rate_limit_key)
+        last, held_back = self._last.get(key, (0, 0))
+
+        if record.created - last < self.interval:
+            self._last[key] = (last, held_back + 1)
+            return False
+
+        self._last[key] = (record.created, 0)
+        if held_back:
+            record.msg = "{} (+{} more)".format(record.msg, held_back)
+
+        return True
+
+
+def configure_logger(logger, *handlers):
+    """
+    Set up a logger to write through a BackgroundLogHandler to handlers,
+    at LOG_LEVEL with rate limited debug records.
+    """
+    logger.setLevel(LOG_LEVEL)
+    logger.addFilter(DebugRateLimit())
+    logger.addHandler(BackgroundLogHandler(*handlers))
+
+    return logger
+
+
+def flush_logger(logger):
+    for handler in logger.handlers:
+        handler.flush()
@@ -1,5 +1,7 @@
-import pandas as pd
 def is_time_delta(x):
+    # pandas is slow to import, only pay for it when it's used
+    import pandas as pd
+
     try:
         pd.Timedelta(x)
         return True
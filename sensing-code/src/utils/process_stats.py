@@ -0,0 +1,42 @@
+"""
+CPU and memory use of the client and its workers, read from /proc, so
+Linux only. Each function returns None where it can't be read, e.g. the
+worker has already exited.
+"""
+import os
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def cpu_seconds(pid, tid=None):
+    """user + system cpu time of a process, or one of its threads."""
+    path = "/proc/{}/stat".format(pid) if tid is None else "/proc/{}/task/{}/stat".format(pid, tid)
+
+    try:
+        with open(path) as f:
+            # the command name may contain spaces, fields after it are fixed
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def rss_bytes(pid):
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+def worker_ids(handle):
+    """(pid, tid) of a service's worker, tid None for a process."""
+    if hasattr(handle.process, "pid"):
+        return handle.process.pid, None
+
+    return os.getpid(), handle.process.native_id
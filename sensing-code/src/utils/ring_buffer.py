@@ -0,0 +1,165 @@
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from ..sensor_services.schema import fill_value
+
+
+# the header holds the total number of records ever written, padded out
+# to a cache line so the records that follow are aligned
+HEADER_SIZE = 64
+
+
+def dtype_from_schema(schema):
+    """
+    Fixed record layout for a service's schema, a timestamp followed by
+    one typed column per key.
+    """
+    return np.dtype([("timestamp", "f8")] + schema.numpy_fields())
+
+
+def share_resource_tracker():
+    """
+    Must be called before starting a process which will attach to a ring
+    buffer. Otherwise the process starts its own resource tracker when it
+    attaches, which then unlinks the buffer from under us when it exits.
+    """
+    resource_tracker.ensure_running()
+
+
+class SampleRingBuffer:
+    """
+    Single producer, single consumer ring buffer of fixed size records in
+    shared memory. The worker process writes samples, and main reads them
+    back as a NumPy structured array without any pickling.
+
+    The writer never blocks: if the reader falls more than `capacity`
+    records behind, the oldest records are overwritten and counted
+    in `dropped`.
+    """
+
+    def __init__(self, shm, dtype, capacity, owner=False):
+        self._shm = shm
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.owner = owner
+
+        self._write_count = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf)
+        self._records = np.ndarray(
+            (capacity,), dtype=self.dtype, buffer=shm.buf, offset=HEADER_SIZE)
+
+        self._read_count = int(self._write_count[0])
+        self.dropped = 0
+
+        self._fills = [(name, fill_value(self.dtype.fields[name][0].str))
+                       for name in self.dtype.names[1:]]
+
+    @classmethod
+    def create(cls, dtype, capacity):
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(
+            create=True, size=HEADER_SIZE + dtype.itemsize * capacity)
+
+        ring_buffer = cls(shm, dtype, capacity, owner=True)
+        ring_buffer._write_count[0] = 0
+        ring_buffer._read_count = 0
+        return ring_buffer
+
+    @classmethod
+    def attach(cls, name, dtype, capacity):
+        return cls(shared_memory.SharedMemory(name=name), dtype, capacity)
+
+    @property
+    def spec(self):
+        """Picklable description, passed to the other process to attach."""
+        return {
+            "name": self._shm.name,
+            "dtype": self.dtype.descr,
+            "capacity": self.capacity
+        }
+
+    def write(self, timestamp, data):
+        """
+        Write one sample, taking each field from the data dict. Values
+        which are missing or can't be converted are written as the
+        field's fill value (NaN for floats).
+        """
+        write_count = int(self._write_count[0])
+        record = self._records[write_count % self.capacity]
+
+        record["timestamp"] = timestamp
+        for name, fill in self._fills:
+            try:
+                record[name] = data[name]
+            except (KeyError, ValueError, TypeError, OverflowError):
+                record[name] = fill
+
+        # publish only once the record is complete
+        self._write_count[0] = write_count + 1
+
+    def read_new(self):
+        """
+        Return every record written since the last read, oldest first.
+
+        Where the records are contiguous in the buffer the result is a view
+        straight onto shared memory, which stays valid until the writer
+        laps it, so copy anything that needs to be kept.
+        """
+        write_count = int(self._write_count[0])
+        available = write_count - self._read_count
+
+        if available > self.capacity:
+            self.dropped += available - self.capacity
+            self._read_count = write_count - self.capacity
+            available = self.capacity
+
+        start = self._read_count % self.capacity
+        end = start + available
+
+        self._read_count = write_count
+
+        if end <= self.capacity:
+            return self._records[start:end]
+
+        return np.concatenate(
+            (self._records[start:], self._records[:end - self.capacity]))
+
+    def samples_around(self, timestamp):
+        """
+        Return the samples either side of timestamp as (newest at or
+        before, oldest after), each (timestamp, data) or None.
+        """
+        write_count = int(self._write_count[0])
+        oldest = max(write_count - self.capacity, 0)
+
+        after = None
+        for count in range(write_count - 1, oldest - 1, -1):
+            record = self._records[count % self.capacity]
+
+            if record["timestamp"] <= timestamp:
+                break
+
+            after = record
+        else:
+            record = None
+
+        return (None if record is None else self._as_sample(record),
+                None if after is None else self._as_sample(after))
+
+    def _as_sample(self, record):
+        values = record.item()
+        return values[0], dict(zip(self.dtype.names[1:], values[1:]))
+
+    def close(self):
+        # drop our views first, shared memory can't close while exported
+        del self._write_count
+        del self._records
+
+        try:
+            self._shm.close()
+        except BufferError:
+            # a reader still holds a view, the mapping goes with it
+            pass
+
+        if self.owner:
+            self._shm.unlink()
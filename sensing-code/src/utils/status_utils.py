@@ -2,6 +2,9 @@
 from enum import Enum
 
 
+# Every message is a (type, seq, payload) tuple. Requests carry a sequence
+# number which the reply echoes, so a late reply can't be mistaken for the
+# answer to a later request. seq is None where no reply is expected.
 class STATUS_MESSAGES(Enum):
     # Client to server:
     DATA_OK = "DATA_OK"
@@ -9,8 +12,10 @@ class STATUS_MESSAGES(Enum):
     DATA_ERROR = "DATA_ERROR"
     HEARTBEAT_ACK = "HEARTBEAT_ACK"
     STOP_ACK = "STOP_ACK"
+    STREAM_DATA = "STREAM_DATA"
 
     # Server to client
     GET_DATA = "GET_DATA"
     HEARTBEAT_SYN = "HEARTBEAT_SYN"
     STOP = "STOP"
+    START_STREAM = "START_STREAM"